@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Measures how many bytes each guild's music state takes, for the original dataclass with a `__dict__` and
+an eagerly built queue against the slotted ClientData, and checks that looking a guild up doesn't create state.
+Run from the repository root with `python -m benchmarks.client_data_memory`."""
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from bot.library import TrackSelector
+from bot.main import ClientData
+from bot.metadata import TrackInfo
+
+
+class OriginalTrackSelector(TrackSelector):
+    """TrackSelector as it was before it was slotted, with room for a `__dict__`."""
+
+
+@dataclass
+class OriginalClientData:
+    queue: TrackSelector = field(default_factory=OriginalTrackSelector)
+    now_playing: str = str()
+    track: Optional[TrackInfo] = None
+    started: float = 0.0
+    paused_at: Optional[float] = None
+    channel: Optional[object] = None
+    message: Optional[object] = None
+
+
+def measure(make: Callable[[], object], guilds: int, groups: list[str], playing: bool) -> float:
+    """Bytes allocated per guild when `guilds` of them are created, optionally queueing groups and playing."""
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    data = {}
+    for guild_id in range(guilds):
+        client_data = data[guild_id] = make()
+
+        if playing:
+            for group in groups:
+                client_data.queue.add(group, 10)
+            client_data.queue.remember(f'music/{groups[0]}/track{guild_id % 10}.flac')
+            client_data.started = time.monotonic()
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / guilds
+
+
+def lookups(music_data: dict, guilds: int) -> int:
+    """How many entries exist after reading the state of guilds that never used the music commands."""
+
+    for guild_id in range(guilds):
+        client_data = music_data.get(guild_id) if not isinstance(music_data, defaultdict) else music_data[guild_id]
+        if client_data and client_data.track:
+            pass
+
+    return len(music_data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=10000)
+    args = parser.parse_args()
+
+    groups = ['anime', 'games', 'lofi']
+
+    for state in ('idle', 'playing'):
+        for name, make in (('original', OriginalClientData), ('slotted', ClientData)):
+            per_guild = measure(make, args.guilds, groups, playing=state == 'playing')
+            print(f'{state:>8} {name:>9}: {per_guild:7.0f} bytes/guild')
+
+    print(f'entries created by {args.guilds} reads: '
+          f'original {lookups(defaultdict(OriginalClientData), args.guilds)}, slotted {lookups({}, args.guilds)}')
+
+
+if __name__ == '__main__':
+    main()
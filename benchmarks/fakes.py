@@ -0,0 +1,490 @@
+"""Stand-ins for the parts of discord.py that need a live connection, for use by the benchmarks."""
+import asyncio
+import itertools
+import os
+import random
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from json import loads
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import discord
+import yaml
+from mutagen.flac import FLAC, Picture
+
+from bot.main import ClientData, FunBot
+from bot.registrations import Registration
+
+FRAME_LENGTH = 0.02
+FRAME_SIZE = 3840  # 20ms of 48kHz 16-bit stereo PCM
+
+BOT_ID = 900
+OWNER_ID = 901  # sends every command, and owns the bot so admin commands work too
+DM_CHANNELS = 10 ** 9  # a user's DM channel is their id plus this
+
+# The REST routes the bot uses, by the names they're counted and timed under
+ROUTES = {
+    ('POST', '/channels/{channel_id}/messages'): 'send_message',
+    ('PATCH', '/channels/{channel_id}/messages/{message_id}'): 'edit_message',
+    ('DELETE', '/channels/{channel_id}/messages/{message_id}'): 'delete_message',
+    ('POST', '/users/@me/channels'): 'create_dm',
+}
+
+
+class SyntheticSource(discord.AudioSource):
+    """PCM silence of a fixed length. Mimics ffmpeg's start up cost by not producing audio until `startup`
+    seconds after it was created, the same way a freshly spawned ffmpeg process has to open and decode first."""
+
+    def __init__(self, duration: float, startup: float = 0.08):
+        self.frames = round(duration / FRAME_LENGTH)
+        self.ready = threading.Event()
+        threading.Timer(startup, self.ready.set).start()
+
+    def read(self) -> bytes:
+        self.ready.wait()
+
+        if self.frames <= 0:
+            return b''
+
+        self.frames -= 1
+        return bytes(FRAME_SIZE)
+
+    def cleanup(self) -> None:
+        self.ready.set()
+
+
+class FakeVoiceClient(discord.VoiceProtocol):
+    """Consumes frames from an AudioSource in real time on its own thread, like discord.py's AudioPlayer,
+    and records when each frame was read. It can be passed as the `cls` of a real voice channel's `connect`,
+    which then takes `handshake` seconds."""
+
+    handshake = 0.3
+
+    def __init__(self, client=None, channel=None):
+        super().__init__(client, channel)
+        self.guild = getattr(channel, 'guild', None)
+        self.source: Optional[discord.AudioSource] = None
+        self.frame_times: list[float] = []
+
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+    def play(self, source: discord.AudioSource, *, after: Optional[Callable] = None) -> None:
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+
+        self.source = source
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(source, after), daemon=True)
+        self.thread.start()
+
+    def run(self, source: discord.AudioSource, after: Optional[Callable]) -> None:
+        next_time = time.perf_counter()
+
+        while not self.stopped.is_set():
+            if not self.resumed.is_set():
+                self.resumed.wait()
+                next_time = time.perf_counter()
+
+            data = source.read()
+            if not data:
+                break
+
+            now = time.perf_counter()
+            self.frame_times.append(now)
+
+            next_time = max(next_time + FRAME_LENGTH, now)
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+        source.cleanup()
+        self.thread = None
+        if after:
+            after(None)
+
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return self.thread is not None and self.resumed.is_set()
+
+    def is_paused(self) -> bool:
+        return self.thread is not None and not self.resumed.is_set()
+
+    def pause(self) -> None:
+        self.resumed.clear()
+
+    def resume(self) -> None:
+        self.resumed.set()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.resumed.set()
+
+    async def connect(self, *, timeout: float, reconnect: bool) -> None:
+        await asyncio.sleep(self.handshake)
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+        if self.client:
+            self.cleanup()
+
+    def gaps(self, count: int) -> list[float]:
+        """The `count` longest pauses between two frames beyond the normal frame length, in seconds."""
+
+        intervals = sorted((b - a for a, b in zip(self.frame_times, self.frame_times[1:])), reverse=True)
+        return [max(0.0, interval - FRAME_LENGTH) for interval in intervals[:count]]
+
+
+def write_flac(path: str, seconds: int, art: Optional[bytes] = None, **tags: str) -> None:
+    """Writes a FLAC file with no audio frames, only a STREAMINFO block saying how long it is, plus tags
+    and optionally a front cover. Enough for mutagen to read a duration, tags and art from it."""
+
+    rate = 44100
+    info = (rate << 44) | ((2 - 1) << 41) | ((16 - 1) << 36) | (rate * seconds)
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6) + info.to_bytes(8, 'big') + bytes(16)
+
+    with open(path, 'wb') as file:
+        file.write(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+
+    if tags or art:
+        flac = FLAC(path)
+        flac.update(tags)
+
+        if art:
+            picture = Picture()
+            picture.type = 3  # front cover
+            picture.mime = 'image/png'
+            picture.data = art
+            flac.add_picture(picture)
+
+        flac.save()
+
+
+def make_library(root: str, groups: int, tracks: int, seconds: tuple[int, int] = (120, 300),
+                 art_size: int = 0) -> list[str]:
+    """Fills `root` with `groups` folders of `tracks` synthetic tracks each, returns their paths.
+    With an `art_size`, every group is an album whose tracks share a cover of that many random bytes."""
+
+    paths = []
+    for group in range(groups):
+        os.makedirs(os.path.join(root, f'group{group}'), exist_ok=True)
+        art = os.urandom(art_size) if art_size else None
+
+        for track in range(tracks):
+            path = os.path.join(root, f'group{group}', f'track{track}.flac')
+            write_flac(path, random.randint(*seconds), art, title=f'Track {track}', artist=f'Artist {group}',
+                       album=f'Album {group}', tracknumber=str(track + 1))
+            paths.append(path)
+
+    return paths
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, channel: 'FakeTextChannel', embed: Optional[discord.Embed] = None, id: Optional[int] = None):
+        self.id = id or next(self.ids)
+        self.channel = channel
+        self.embeds = [embed] if embed else []
+        self.attachments = []
+
+    async def edit(self, *, embed: Optional[discord.Embed] = None, **kwargs) -> None:
+        await self.channel.api.call('edit_message', self.channel.id)
+        if embed:
+            self.embeds = [embed]
+
+    async def delete(self) -> None:
+        await self.channel.api.call('delete_message', self.channel.id)
+
+
+def timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def user_payload(id: int) -> dict:
+    return {'id': str(id), 'username': f'user{id}', 'discriminator': f'{id % 10000:04}', 'avatar': None,
+            'bot': id == BOT_ID}
+
+
+def member_payload(id: int) -> dict:
+    return {'user': user_payload(id), 'roles': [], 'joined_at': timestamp(), 'deaf': False, 'mute': False}
+
+
+def message_payload(id: int, channel_id: int, author: dict, content: str = '', embed: Optional[dict] = None,
+                    filenames: tuple[str, ...] = ()) -> dict:
+    return {'id': str(id), 'channel_id': str(channel_id), 'author': author, 'content': content,
+            'embeds': [embed] if embed else [],
+            'attachments': [{'id': str(id), 'filename': filename, 'size': 0,
+                             'url': f'https://cdn.example/{id}/{filename}',
+                             'proxy_url': f'https://media.example/{id}/{filename}'} for filename in filenames],
+            'timestamp': timestamp(), 'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+            'mentions': [], 'mention_roles': [], 'pinned': False, 'type': 0}
+
+
+def guild_payload(id: int) -> dict:
+    """A guild the way GUILD_CREATE sends it, with a text channel, a voice channel, and the owner sitting in it."""
+
+    text_channel, voice_channel = id * 10 + 1, id * 10 + 2
+    return {
+        'id': str(id), 'name': f'guild{id}', 'owner_id': str(OWNER_ID), 'large': False, 'member_count': 2,
+        'roles': [{'id': str(id), 'name': '@everyone', 'permissions': str(discord.Permissions.general().value)}],
+        'channels': [
+            {'id': str(text_channel), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': []},
+            {'id': str(voice_channel), 'type': 2, 'name': 'music', 'position': 1, 'permission_overwrites': [],
+             'bitrate': 64000, 'user_limit': 0},
+        ],
+        'members': [member_payload(BOT_ID), member_payload(OWNER_ID)],
+        'voice_states': [{'user_id': str(OWNER_ID), 'channel_id': str(voice_channel), 'session_id': 'benchmark',
+                          'deaf': False, 'mute': False, 'self_deaf': False, 'self_mute': False,
+                          'self_video': False, 'suppress': False}],
+    }
+
+
+class FakeAPI:
+    """Pretends to be Discord's REST API, every call takes `latency` seconds plus up to `jitter` more,
+    and is counted and timed by route. `request` stands in for discord.py's HTTPClient.request and answers with
+    the JSON Discord would, so everything above it is the real library."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: dict[str, int] = {}
+        self.durations: dict[str, list[float]] = {}
+        self.finished: dict[str, list[float]] = {}  # time.perf_counter() of when each call returned
+
+        self.message_ids = itertools.count(10 ** 6)
+        self.dm_channels: dict[int, int] = {}  # DM channel id -> user id
+        self.closed: set[int] = set()  # users who don't accept DMs
+
+    async def call(self, route: str, channel_id: int) -> None:
+        self.calls[route] = self.calls.get(route, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency + random.random() * self.jitter)
+        finished = time.perf_counter()
+        self.durations.setdefault(route, []).append(finished - started)
+        self.finished.setdefault(route, []).append(finished)
+
+    async def request(self, route: discord.http.Route, *, json: Optional[dict] = None, form: Optional[list] = None,
+                      files: Optional[list[discord.File]] = None, **kwargs) -> Optional[dict]:
+        name = ROUTES.get((route.method, route.path), route.path)
+        if name == 'send_message' and route.channel_id in self.dm_channels:
+            name = 'send_dm'
+        elif name == 'send_message' and files:
+            name = 'upload_file'
+
+        await self.call(name, route.channel_id)
+
+        if name == 'create_dm':
+            user_id = int(json['recipient_id'])
+            self.dm_channels[user_id + DM_CHANNELS] = user_id
+            return {'id': str(user_id + DM_CHANNELS), 'type': 1, 'last_message_id': None,
+                    'recipients': [user_payload(user_id)]}
+
+        if name == 'send_dm' and self.dm_channels[route.channel_id] in self.closed:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason='Forbidden'),
+                                    'Cannot send messages to this user')
+
+        if name == 'delete_message':
+            return None
+
+        if form:
+            json = loads(form[0]['value'])  # the payload_json part, the rest are the files
+
+        json = json or {}
+        message_id = int(route.url.rsplit('/', 1)[1]) if name == 'edit_message' else next(self.message_ids)
+        return message_payload(message_id, route.channel_id, user_payload(BOT_ID), json.get('content') or '',
+                               json.get('embed'), tuple(file.filename for file in files or ()))
+
+
+class FakeUser:
+    """A user that can be sent DMs, or refuses them like someone who closed their DMs."""
+
+    def __init__(self, id: int, api: FakeAPI, closed: bool = False):
+        self.id = id
+        self.api = api
+        self.closed = closed
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None, **kwargs) -> None:
+        await self.api.call('send_dm', self.id)
+
+        if self.closed:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason='Forbidden'),
+                                    'Cannot send messages to this user')
+
+
+def make_users(count: int, api: FakeAPI, missing: float = 0.0, closed: float = 0.0) -> dict[int, FakeUser]:
+    """Users 1 to `count`, leaving out a `missing` fraction of them and closing the DMs of a `closed` fraction."""
+
+    users = {}
+    for user_id in range(1, count + 1):
+        if random.random() >= missing:
+            users[user_id] = FakeUser(user_id, api, closed=random.random() < closed)
+
+    return users
+
+
+def make_registrations(count: int, guilds: int, lunch_periods: tuple[int, ...] = (5, 6),
+                       every_day: float = 0.5) -> dict[int, Registration]:
+    """Reminder registrations for users 1 to `count`, spread over guilds 1 to `guilds`."""
+
+    return {user_id: Registration(random.choice(lunch_periods), random.random() < every_day,
+                                  random.randint(1, guilds))
+            for user_id in range(1, count + 1)}
+
+
+class FakeTextChannel:
+    def __init__(self, id: int, guild: 'FakeGuild', api: FakeAPI):
+        self.id = id
+        self.guild = guild
+        self.api = api
+        self.sent: list[FakeMessage] = []
+
+    async def send(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                   file: Optional[discord.File] = None, **kwargs) -> FakeMessage:
+        await self.api.call('send_message', self.id)
+
+        message = FakeMessage(self, embed)
+        if file:
+            message.attachments = [SimpleNamespace(url=f'https://cdn.example/{message.id}/{file.filename}')]
+
+        self.sent.append(message)
+        return message
+
+    def get_partial_message(self, id: int) -> FakeMessage:
+        return FakeMessage(self, id=id)
+
+
+class FakeVoiceChannel:
+    def __init__(self, id: int, guild: 'FakeGuild', handshake: float = 0.3):
+        self.id = id
+        self.guild = guild
+        self.handshake = handshake
+
+    async def connect(self) -> FakeVoiceClient:
+        await asyncio.sleep(self.handshake)
+        self.guild.voice_client = FakeVoiceClient(channel=self)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self, id: int, api: FakeAPI, handshake: float = 0.3):
+        self.id = id
+        self.voice_client: Optional[FakeVoiceClient] = None
+        self.text_channel = FakeTextChannel(id * 10 + 1, self, api)
+        self.voice_channel = FakeVoiceChannel(id * 10 + 2, self, handshake)
+
+    def get_channel(self, id: int):
+        return {self.text_channel.id: self.text_channel, self.voice_channel.id: self.voice_channel}.get(id)
+
+
+class FakeGateway:
+    """Stands in for a real FunBot's gateway connection. Fills its cache with the guilds, members and users Discord
+    would send it, and delivers commands as messages through `process_commands`, timing each one from being
+    received to being handled."""
+
+    def __init__(self, bot: FunBot, api: FakeAPI):
+        self.bot = bot
+        self.api = api
+        self.state = bot._connection
+        self.latencies: list[float] = []
+
+    def connect(self, guilds: int) -> None:
+        """Guilds 1 to `guilds`, then READY."""
+
+        self.state.user = discord.ClientUser(state=self.state, data=user_payload(BOT_ID))
+        for guild_id in range(1, guilds + 1):
+            self.state._add_guild_from_data(guild_payload(guild_id))
+
+        self.bot._ready.set()
+
+    def add_users(self, count: int, missing: float = 0.0, closed: float = 0.0) -> None:
+        """Users 1 to `count` as members of the guilds, leaving out a `missing` fraction of them and closing the DMs
+        of a `closed` fraction. The bot only keeps users that something else refers to, like a member."""
+
+        guilds = self.bot.guilds
+        for user_id in range(1, count + 1):
+            if random.random() >= missing:
+                guild = guilds[user_id % len(guilds)]
+                guild._add_member(discord.Member(data=member_payload(user_id), guild=guild, state=self.state))
+                if random.random() < closed:
+                    self.api.closed.add(user_id)
+
+    async def command(self, guild_id: int, content: str) -> None:
+        channel = self.bot.get_channel(guild_id * 10 + 1)
+        data = message_payload(next(self.api.message_ids), channel.id, user_payload(OWNER_ID), content)
+        data['member'] = member_payload(OWNER_ID)
+
+        started = time.perf_counter()
+        await self.bot.process_commands(self.state.create_message(channel=channel, data=data))
+        self.latencies.append(time.perf_counter() - started)
+
+
+def make_bot(api: FakeAPI, guilds: int, config: Optional[dict] = None) -> tuple[FunBot, FakeGateway]:
+    """A real FunBot in guilds 1 to `guilds`, with its REST requests answered by `api`. It reads config.yaml from
+    the working directory like it always does, so `config` is written there first. Guild 1's text channel is
+    the cover art cache channel unless `config` says otherwise."""
+
+    sections = {'Bot': {'token': 'benchmark', 'cache_channel': 11}, 'Cogs': {'blacklist': []}}
+    for section, values in (config or {}).items():
+        sections.setdefault(section, {}).update(values)
+
+    with open('config.yaml', 'w') as file:
+        yaml.safe_dump(sections, file)
+
+    bot = FunBot()
+    bot.owner_id = OWNER_ID
+    bot.http.request = api.request
+
+    gateway = FakeGateway(bot, api)
+    gateway.connect(guilds)
+    return bot, gateway
+
+
+class FakeBot:
+    """Just enough of FunBot for the cogs to be created and run their background work."""
+
+    def __init__(self, guilds: int, api: Optional[FakeAPI] = None, handshake: float = 0.3,
+                 config: Optional[dict] = None):
+        self.api = api or FakeAPI()
+        self.guilds = {id: FakeGuild(id, self.api, handshake) for id in range(1, guilds + 1)}
+        self.config = config or {'Bot': {'cache_channel': 0}, 'Music': {}}
+        self.color = discord.Color.gold()
+        self.loop = asyncio.get_event_loop()
+        self.music_data: dict[int, ClientData] = {}
+        self.cache_channel = FakeTextChannel(0, None, self.api)
+        self.cogs: dict = {}
+
+    client_data = FunBot.client_data
+
+    @property
+    def voice_clients(self) -> list[FakeVoiceClient]:
+        return [guild.voice_client for guild in self.guilds.values() if guild.voice_client]
+
+    def get_guild(self, id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(id)
+
+    def get_channel(self, id: int):
+        if id == self.cache_channel.id:
+            return self.cache_channel
+
+        return next((channel for guild in self.guilds.values() if (channel := guild.get_channel(id))), None)
+
+    def add_cog(self, cog) -> None:
+        self.cogs[cog.qualified_name] = cog
+
+    def remove_cog(self, name: str) -> None:
+        cog = self.cogs.pop(name, None)
+        if cog:
+            cog.cog_unload()
+
+    def get_cog(self, name: str):
+        return self.cogs.get(name)
+
+    async def wait_until_ready(self) -> None:
+        pass
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measures the silence between tracks when each track is started from the `after` callback,
+against queueing it ahead of time in a QueueSource. Run from the repository root with `python -m benchmarks.gapless`."""
+import argparse
+import asyncio
+import statistics
+
+from bot.audio import QueueSource
+
+from .fakes import FakeVoiceClient, SyntheticSource
+
+
+async def after_callback(tracks: int, duration: float, startup: float) -> FakeVoiceClient:
+    """The old way, a new source is only created once the previous one has finished."""
+
+    loop = asyncio.get_running_loop()
+    client = FakeVoiceClient()
+    done = asyncio.Event()
+    remaining = iter(range(tracks))
+
+    def start_next():
+        if next(remaining, None) is None:
+            done.set()
+            return
+        client.play(SyntheticSource(duration, startup), after=lambda e: loop.call_soon_threadsafe(start_next))
+
+    start_next()
+    await done.wait()
+    return client
+
+
+async def prefetched(tracks: int, duration: float, startup: float, prefetch: float) -> FakeVoiceClient:
+    loop = asyncio.get_running_loop()
+    client = FakeVoiceClient()
+    done = asyncio.Event()
+    remaining = iter(range(1, tracks))
+
+    def queue_next():
+        if next(remaining, None) is not None:
+            source.queue_next(SyntheticSource(duration, startup), duration, None)
+
+    source = QueueSource(SyntheticSource(duration, startup), duration,
+                         on_prefetch=lambda: loop.call_soon_threadsafe(queue_next),
+                         on_switch=lambda tag, started: None, prefetch=prefetch)
+    client.play(source, after=lambda e: loop.call_soon_threadsafe(done.set))
+
+    await done.wait()
+    return client
+
+
+def report(name: str, client: FakeVoiceClient, transitions: int) -> None:
+    gaps = [gap * 1000 for gap in client.gaps(transitions)]
+    print(f'{name:>15}: mean {statistics.mean(gaps):6.1f} ms, max {max(gaps):6.1f} ms over {transitions} transitions')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=6)
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds per track')
+    parser.add_argument('--startup', type=float, default=0.08, help='simulated ffmpeg start up time in seconds')
+    parser.add_argument('--prefetch', type=float, default=0.3, help='seconds before the end to queue the next track')
+    args = parser.parse_args()
+
+    report('after callback', await after_callback(args.tracks, args.duration, args.startup), args.tracks - 1)
+    report('prefetched', await prefetched(args.tracks, args.duration, args.startup, args.prefetch), args.tracks - 1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
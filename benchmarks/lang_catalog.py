@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Compares building an embed through the precompiled message catalog against parsing lang.yaml on every call.
+Run from the repository root with `python -m benchmarks.lang_catalog`."""
+import timeit
+from typing import Union
+
+import discord
+from yaml import safe_load
+
+from bot.lang import MessageCatalog, color_to_discord
+
+KEYS = [
+    ('music.queued', {'groups': ['anime', 'games', 'rhythm']}),
+    ('error.command_not_found', {'prefix': '&', 'failed_command': 'foo'}),
+    ('general.ping', {}),
+]
+
+
+def dotted_access_dict(input_dict: dict, keys: Union[str, list]):
+    if isinstance(keys, str):
+        keys = keys.split('.')
+
+    if len(keys) == 1:
+        return input_dict.get(keys[0], input_dict)
+    else:
+        return dotted_access_dict(input_dict[keys[0]], keys[1:])
+
+
+def get_highest_color(input_dict: dict, key: str):
+    color = dotted_access_dict(input_dict, key).get('color')
+
+    if color:
+        return color
+
+    return get_highest_color(input_dict, '.'.join(key.split('.')[:-1]))
+
+
+def per_call_parse(key: str, **kwargs) -> discord.Embed:
+    """The original send_embed, minus the send."""
+    with open('bot/lang.yaml', 'r') as file:
+        all_data = safe_load(file)
+
+    data = dotted_access_dict(all_data, key)
+    color = color_to_discord(get_highest_color(all_data, key))
+
+    description = data.get('description', key + '.description')
+    title = data.get('title', '')
+
+    for placeholder, value in kwargs.items():
+        if placeholder == 'groups':
+            value = '`, `'.join(value)
+
+        description = description.replace(f'%{{{placeholder}}}', str(value))
+        title = title.replace(f'%{{{placeholder}}}', str(value))
+
+    return discord.Embed(title=title, description=description, color=color)
+
+
+def main():
+    catalog = MessageCatalog('bot/lang.yaml')
+    catalog.load()
+
+    for key, kwargs in KEYS:
+        assert per_call_parse(key, **kwargs).to_dict() == catalog[key].make_embed(**kwargs).to_dict(), key
+
+    for name, func in (('per-call parse', per_call_parse), ('catalog', lambda k, **kw: catalog[k].make_embed(**kw))):
+        number = 200 if name == 'per-call parse' else 20000
+        total = timeit.timeit(lambda: [func(key, **kwargs) for key, kwargs in KEYS], number=number)
+        print(f'{name:>15}: {total / (number * len(KEYS)) * 1e6:9.2f} us/embed')
+
+
+if __name__ == '__main__':
+    main()
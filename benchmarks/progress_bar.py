@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Compares the cost of rendering one progress bar update with the original string splitting against the
+precomputed renderer. Run from the repository root with `python -m benchmarks.progress_bar`."""
+import timeit
+from datetime import timedelta
+
+from bot.progress import create_bar
+
+
+def original_timedelta_to_str(time: timedelta) -> str:
+    output = str(time).split(':', 1)[1]
+    if output[0] == '0':
+        output = output[1:]
+
+    return output
+
+
+def original_create_bar(current_time: timedelta, total_time: timedelta) -> str:
+    str_current_time = original_timedelta_to_str(current_time)
+    str_total_time = original_timedelta_to_str(total_time)
+
+    start = round(current_time / total_time * 30)
+    bar = '▬' * start + '🔘' + '▬' * (29 - start)
+
+    return f'`{str_current_time} {bar} {str_total_time}`'
+
+
+def main():
+    total = timedelta(seconds=245)
+    updates = [timedelta(seconds=second) for second in range(0, 246, 5)]
+
+    for current in updates:
+        assert original_create_bar(current, total) == create_bar(current, total), current
+
+    number = 2000
+    for name, func in (('original', original_create_bar), ('precomputed', create_bar)):
+        elapsed = timeit.timeit(lambda: [func(current, total) for current in updates], number=number)
+        print(f'{name:>12}: {elapsed / (number * len(updates)) * 1e9:7.0f} ns/update')
+
+
+if __name__ == '__main__':
+    main()
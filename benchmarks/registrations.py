@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Runs many registrations at the same time, the way interleaved `register` prompts do, against the original
+read-modify-write of user_data.json and against the RegistrationStore, then counts how many survived a reload.
+The store is written by several processes at once, each with its own connection, and the run exits non-zero if
+any of their rows is missing or different after the reload. Also compares the cost of looking up one
+registration. Run from the repository root with `python -m benchmarks.registrations`."""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+
+from bot.registrations import Registration, RegistrationStore
+
+
+async def register_json(user_id: int) -> None:
+    """The original register command, reading the file before the prompts and writing it after."""
+
+    with open("user_data.json", "r+") as file:
+        file_data = json.load(file)
+
+    await asyncio.sleep(random.random() * 0.05)  # the user reacting to the prompts
+
+    file_data[str(user_id)] = {"lunch_period": random.choice([5, 6]), "every_day": random.random() < 0.5}
+    with open("user_data.json", "w+") as file:
+        json.dump(file_data, file, indent=4)
+
+
+def wait_for_writers(barrier: multiprocessing.Barrier) -> None:
+    barrier.wait()  # every writer starts at once, so their writes overlap
+
+
+def register_store(user_ids: range) -> dict[int, Registration]:
+    """One writer, with a connection of its own like another process sharing the database would have.
+    Returns what it wrote."""
+
+    store = RegistrationStore('registrations.db')
+    written = {}
+
+    for user_id in user_ids:
+        registration = written[user_id] = Registration(random.choice([5, 6]), random.random() < 0.5,
+                                                       random.randint(1, 10))
+        store.add(user_id, registration)
+
+    store.close()
+    return written
+
+
+def lookup_json(user_id: int) -> dict:
+    with open("user_data.json", "r+") as file:
+        return json.load(file)[str(user_id)]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--writers', type=int, default=8, help='processes writing to the store at the same time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+
+        with open("user_data.json", "w") as file:
+            json.dump({}, file)
+
+        await asyncio.gather(*(register_json(user_id) for user_id in range(args.users)))
+        with open("user_data.json") as file:
+            print(f'{"json":>6}: {len(json.load(file))}/{args.users} registrations kept')
+
+        RegistrationStore('registrations.db').close()  # the schema exists before the writers connect
+
+        written = {}
+        barrier = multiprocessing.Barrier(args.writers)
+        with ProcessPoolExecutor(args.writers, initializer=wait_for_writers, initargs=(barrier,)) as executor:
+            # Interleaved, so the writers' rows end up next to each other in the table
+            for rows in executor.map(register_store, (range(writer, args.users, args.writers)
+                                                      for writer in range(args.writers))):
+                written.update(rows)
+
+        store = RegistrationStore('registrations.db')
+        lost = [user_id for user_id, registration in written.items() if store.get(user_id) != registration]
+        print(f'{"store":>6}: {len(written) - len(lost)}/{args.users} registrations kept '
+              f'from {args.writers} writers')
+        store_lookup = timeit.timeit(lambda: store.get(0), number=200000) / 200000
+
+        with open("user_data.json", "w") as file:
+            json.dump({str(user_id): {"lunch_period": registration.lunch_period, "every_day": registration.every_day}
+                       for user_id, registration in store.items()}, file, indent=4)
+        json_lookup = timeit.timeit(lambda: lookup_json(0), number=200) / 200
+        store.close()
+
+        print(f'lookup: json {json_lookup * 1e6:.0f} µs, store {store_lookup * 1e6:.2f} µs')
+
+    if lost:
+        sys.exit(f'Lost {len(lost)} registrations written at the same time, like user {lost[0]}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
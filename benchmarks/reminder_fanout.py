@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Measures how late period reminders arrive when they're sent one user at a time against the concurrent,
+rate limited fan out, with some users who can't be found or have closed their DMs.
+Run from the repository root with `python -m benchmarks.reminder_fanout`."""
+import argparse
+import asyncio
+import time
+
+import discord
+
+from bot.delivery import DirectMessageFanOut, percentile
+
+from .fakes import FakeAPI, FakeUser, make_users
+
+
+async def sequential(user_ids: list[int], users: dict[int, FakeUser]) -> list[float]:
+    """The original loop, a new embed and one send at a time."""
+
+    started = time.monotonic()
+    latencies = []
+
+    for user_id in user_ids:
+        embed = discord.Embed(title="Class starting!", description="Period 1 is staring in one minute!")
+        user = users.get(user_id)
+
+        try:
+            await user.send(embed=embed)
+        except (AttributeError, discord.Forbidden):
+            continue
+
+        latencies.append(time.monotonic() - started)
+
+    return latencies
+
+
+def report(name: str, latencies: list[float], elapsed: float) -> None:
+    latencies = sorted(latencies)
+    print(f'{name:>10}: {len(latencies)} sent in {elapsed:6.2f} s, p50 {percentile(latencies, 0.5):6.2f} s, '
+          f'p90 {percentile(latencies, 0.9):6.2f} s, p99 {percentile(latencies, 0.99):6.2f} s')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.1, help='simulated time each DM takes in seconds')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=20.0)
+    args = parser.parse_args()
+
+    api = FakeAPI(args.latency)
+    users = make_users(args.users, api, missing=0.02, closed=0.05)
+    user_ids = list(range(1, args.users + 1))
+
+    started = time.monotonic()
+    report('sequential', await sequential(user_ids, users), time.monotonic() - started)
+
+    fan_out = DirectMessageFanOut(users.get, concurrency=args.concurrency, rate=args.rate)
+    started = time.monotonic()
+    await fan_out.run(set(user_ids), discord.Embed(title="Class starting!"))
+    report('fan out', fan_out.latencies, time.monotonic() - started)
+
+    stats = fan_out.stats()
+    print(f"{'':>10}  {stats['missing']} missing, {stats['closed']} closed DMs, {stats['failed']} failed")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
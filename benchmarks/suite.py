@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Runs the bot's busiest paths offline and reports each scenario's throughput, latency percentiles and peak RSS.
+The bot is a real FunBot with real cogs, only its gateway, REST API and voice connections are fake, and commands
+are sent to it as messages, so its checks, invoke hooks and error handler are measured too. Every scenario runs in
+its own process so its peak RSS is its own. Run from the repository root with
+`python -m benchmarks.suite [scenario ...]`.
+
+    music      &playall in N guilds, with bar_update_loop editing their now playing messages
+    embeds     bursts of commands that answer with send_embed, and some mistyped ones, across every guild
+    reminders  a period's reminder DMs fanned out to M registered users
+    art        &populate_cache uploading the cover art of K tracks"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bot.cogs.music import Music
+from bot.cogs.reminder import Reminder
+from bot.delivery import percentile
+from bot.lang import catalog
+from bot.main import FunBot
+from bot.outbox import outbox
+from bot.registrations import RegistrationStore
+
+from .fakes import FRAME_LENGTH, FakeAPI, FakeVoiceClient, SyntheticSource, make_bot, make_library, \
+    make_registrations
+
+
+def peak_rss() -> float:
+    """The most memory this process has used, in MiB."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(name: str, count: int, unit: str, elapsed: float, latencies: list[float], latency: str) -> None:
+    latencies = sorted(latencies)
+    print(f'{name:>10}: {count} {unit} in {elapsed:6.2f} s ({count / elapsed:8.1f}/s), {latency} '
+          f'p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, p90 {percentile(latencies, 0.9) * 1000:7.1f} ms, '
+          f'p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, peak RSS {peak_rss():6.1f} MiB')
+
+
+async def start_music(bot: FunBot) -> Music:
+    bot.add_cog(Music(bot))
+    await bot.cog_startups['Music']
+
+    cog = bot.get_cog('Music')
+    cog.restore_task.cancel()
+    cog.open_source = lambda path, position=0.0, duration=None: SyntheticSource(600.0, startup=0.0)
+
+    return cog
+
+
+async def connect_voice(bot: FunBot) -> None:
+    """Joins the voice channel of every guild and picks its text channel for now playing messages, like the join
+    command does. That would connect for real, so it's done up front instead."""
+
+    await asyncio.gather(*(guild.voice_channels[0].connect(cls=FakeVoiceClient) for guild in bot.guilds))
+
+    for guild in bot.guilds:
+        bot.client_data(guild.id).channel_id = guild.text_channels[0].id
+
+
+async def outbox_drained() -> None:
+    """Waits for the replies still queued, like the ones on_command_error sends after the command has returned."""
+
+    while outbox.workers:
+        await asyncio.gather(*outbox.workers.values())
+
+
+async def music(args) -> None:
+    make_library('music', groups=args.groups, tracks=args.tracks)
+
+    api = FakeAPI(args.latency, args.jitter)
+    bot, gateway = make_bot(api, args.guilds)
+    cog = await start_music(bot)
+    cog.bars.interval = args.bar_interval
+    await connect_voice(bot)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(gateway.command(guild.id, '&playall') for guild in bot.guilds))
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+
+    cog.after_track = lambda guild_id, error: None  # don't start another track when they're stopped
+    for client in bot.voice_clients:
+        client.stop()
+    bot.remove_cog('Music')
+
+    # How much later than its 20 ms slot each frame was read, a stand in for audible stutter
+    frame_delays = [max(0.0, b - a - FRAME_LENGTH) for client in bot.voice_clients
+                    for a, b in zip(client.frame_times, client.frame_times[1:])]
+    stats = cog.bars.stats()
+
+    report('music', stats['edits'], 'bar edits', elapsed, api.durations.get('edit_message', []), 'edit')
+    print(f"{'':>10}  {stats['skipped']} edits skipped for an unchanged bar, {stats['rate_limited']} rate limited")
+    report('', len(frame_delays), 'frames', elapsed, frame_delays, 'frame delay')
+
+
+async def embeds(args) -> None:
+    make_library('music', groups=args.groups, tracks=args.tracks)
+
+    api = FakeAPI(args.latency, args.jitter)
+    bot, gateway = make_bot(api, args.guilds)
+    await start_music(bot)
+    await connect_voice(bot)
+
+    # The last one isn't a command, so it's answered by on_command_error
+    commands = ['&list', '&queue', '&nowplaying', '&nowplayng']
+    started = time.perf_counter()
+
+    for burst in range(args.bursts):
+        await asyncio.gather(*(gateway.command(guild.id, commands[(burst + guild.id) % len(commands)])
+                               for guild in bot.guilds for _ in range(args.burst_size)))
+    await outbox_drained()
+
+    elapsed = time.perf_counter() - started
+    bot.remove_cog('Music')
+
+    report('embeds', len(gateway.latencies), 'commands', elapsed, gateway.latencies, 'command')
+    print(f"{'':>10}  {api.calls.get('send_message', 0)} replies sent")
+
+
+async def reminders(args) -> None:
+    store = RegistrationStore('registrations.db')
+    for user_id, registration in make_registrations(args.users, args.guilds).items():
+        store.add(user_id, registration)
+    store.close()
+
+    api = FakeAPI(args.latency, args.jitter)
+    bot, gateway = make_bot(api, args.guilds,
+                            config={'Reminder': {'dm_concurrency': args.concurrency, 'dm_rate': args.rate}})
+    gateway.add_users(args.users, missing=0.02, closed=0.05)
+
+    bot.add_cog(Reminder(bot))
+    cog = bot.get_cog('Reminder')
+    cog.main_task.cancel()
+
+    started = time.perf_counter()
+    await cog.send_reminders('default', 1, 0)  # first period on a Monday, electives included
+    elapsed = time.perf_counter() - started
+    bot.remove_cog('Reminder')
+
+    # The fan out only keeps rounded latencies, so they're measured from when each DM was sent instead
+    latencies = [finished - started for finished in api.finished.get('send_dm', [])]
+    report('reminders', cog.last_run['sent'], 'DMs', elapsed, latencies, 'delivery')
+
+
+async def art(args) -> None:
+    paths = make_library('music', groups=max(1, args.files // args.tracks), tracks=args.tracks,
+                         art_size=args.art_size)
+
+    api = FakeAPI(args.latency, args.jitter)
+    bot, gateway = make_bot(api, 1, config={'Music': {'upload_concurrency': args.concurrency,
+                                                      'upload_rate': args.rate}})
+    cog = await start_music(bot)
+
+    cached = {}
+    add = cog.cache.add
+
+    def timed_add(path, *args):
+        cached[path] = time.perf_counter()
+        add(path, *args)
+
+    cog.cache.add = timed_add
+
+    started = time.perf_counter()
+    await gateway.command(1, '&populate_cache')
+    elapsed = time.perf_counter() - started
+    bot.remove_cog('Music')
+
+    report('art', len(cached), 'tracks', elapsed, [finished - started for finished in cached.values()], 'cached')
+    print(f"{'':>10}  {len(paths)} files, {api.calls.get('upload_file', 0)} uploads")
+
+
+SCENARIOS = {'music': music, 'embeds': embeds, 'reminders': reminders, 'art': art}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)}, all of them by default")
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated REST request time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05, help='up to this much longer for some requests')
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--tracks', type=int, default=20, help='tracks in each group')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds of music to play')
+    parser.add_argument('--bar-interval', type=float, default=5.0)
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--burst-size', type=int, default=4, help='commands per guild in each burst')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--art-size', type=int, default=64 * 1024, help='bytes of cover art for each album')
+    parser.add_argument('--concurrency', type=int, default=10, help='DM or upload workers')
+    parser.add_argument('--rate', type=float, default=20.0, help='DMs or uploads started per second')
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}')
+
+    if len(args.scenarios) != 1:
+        options = [arg for arg in sys.argv[1:] if arg not in SCENARIOS]
+        for name in args.scenarios or SCENARIOS:
+            subprocess.run([sys.executable, '-m', 'benchmarks.suite', name, *options], check=True)
+        return
+
+    # The scenarios run in a scratch directory, so the message catalog needs to be found from anywhere
+    catalog.path = os.path.abspath(catalog.path)
+    catalog.load()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        asyncio.run(SCENARIOS[args.scenarios[0]](args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Measures how long a restarted bot takes to get audio playing again in every guild that was playing before,
+restoring guilds one after another against restoring them all at once.
+Run from the repository root with `python -m benchmarks.warm_restart`."""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from bot.cogs.music import Music
+from bot.playback import PlaybackStore
+
+from .fakes import FakeBot, SyntheticSource, make_library
+
+
+def save_state(guilds: int, groups: list[str], tracks: list[str]) -> None:
+    store = PlaybackStore('playback.db')
+
+    for guild_id in range(1, guilds + 1):
+        store.save_channels(guild_id, guild_id * 10 + 2, guild_id * 10 + 1)
+        store.save_queue(guild_id, groups)
+        store.save_track(guild_id, tracks[guild_id % len(tracks)], position=30.0)
+
+    store.close()
+
+
+async def first_audio(bot: FakeBot) -> list[float]:
+    """Waits for every guild to have read a frame, returns when each one did."""
+
+    while len(bot.voice_clients) < len(bot.guilds) or not all(client.frame_times for client in bot.voice_clients):
+        await asyncio.sleep(0.005)
+
+    return [client.frame_times[0] for client in bot.voice_clients]
+
+
+async def restore(guilds: int, handshake: float, startup: float, parallel: bool) -> list[float]:
+    started = time.perf_counter()
+
+    bot = FakeBot(guilds, handshake=handshake)
+    cog = Music(bot)
+    bot.add_cog(cog)
+    await cog.startup()
+    cog.open_source = lambda path, position=0.0, duration=None: SyntheticSource(600.0, startup)
+    cog.restore_task.cancel()
+
+    if parallel:
+        await cog.restore_playback()
+    else:
+        for saved in cog.playback.load():
+            await cog.restore_guild(saved)
+
+    times = [first - started for first in await first_audio(bot)]
+
+    for client in bot.voice_clients:
+        client.stop()
+    bot.remove_cog('Music')  # so the stopped players don't start another track
+
+    # Their after callbacks are scheduled on the loop, which has to outlive them
+    while any(client.thread for client in bot.voice_clients):
+        await asyncio.sleep(0.005)
+
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    print(f'{name:>10}: median {statistics.median(times):6.2f} s, last guild {max(times):6.2f} s')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=25)
+    parser.add_argument('--handshake', type=float, default=0.3, help='simulated voice connection time in seconds')
+    parser.add_argument('--startup', type=float, default=0.08, help='simulated ffmpeg start up time in seconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        tracks = make_library('music', groups=4, tracks=10)
+
+        save_state(args.guilds, ['group0', 'group1'], tracks)
+        report('serial', await restore(args.guilds, args.handshake, args.startup, parallel=False))
+
+        save_state(args.guilds, ['group0', 'group1'], tracks)
+        report('parallel', await restore(args.guilds, args.handshake, args.startup, parallel=True))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Iterator, Optional
+
+from .metadata import MetadataService
+from .outbox import Pacer
+
+Uploader = Callable[[bytes, str, Optional[Pacer]], Awaitable[str]]
+
+MISSING = object()
+
+
+def art_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ArtStore:
+    """Persistent cover art cache backed by SQLite, with images identified by a hash of their data.
+    Tracks map to an image hash (or NULL when they have no art) and each distinct image maps to one uploaded url.
+    Every write is its own transaction in WAL mode, so a crash can never leave the store half written.
+    Rows are read on demand and remembered, nothing is loaded up front."""
+
+    def __init__(self, path: str = 'art_cache.db'):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY KEY, hash TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, url TEXT, size INTEGER)')
+
+        self.memo: dict[str, Optional[str]] = {}
+
+    def import_urls(self, urls: dict[str, Optional[str]]) -> None:
+        """Imports a path to url mapping from before images were hashed.
+        Their data is unknown, so each url stands in for its own image with an unknown size."""
+
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR IGNORE INTO images VALUES (?, ?, 0)',
+                                ((f'url:{url}', url) for url in urls.values() if url))
+            self.db.executemany('INSERT OR IGNORE INTO tracks VALUES (?, ?)',
+                                ((path, f'url:{url}' if url else None) for path, url in urls.items()))
+
+    def migrate_json(self, json_path: str = 'cache.json') -> None:
+        """One time import of the old cache.json, which is renamed afterwards so it isn't imported again."""
+
+        if not os.path.exists(json_path):
+            return
+
+        with open(json_path, 'r') as file:
+            old_cache: dict[str, Optional[str]] = json.load(file)
+
+        self.import_urls(old_cache)
+
+        os.replace(json_path, json_path + '.migrated')
+        print(f"Migrated {len(old_cache)} entries from {json_path}")
+
+    def get(self, path: str, default=None) -> Optional[str]:
+        url = self.memo.get(path, MISSING)
+
+        if url is MISSING:
+            row = self.db.execute('SELECT images.url FROM tracks LEFT JOIN images USING (hash) WHERE path = ?',
+                                  (path,)).fetchone()
+            if row is None:
+                return default
+            url = self.memo[path] = row[0]
+
+        return url
+
+    def __contains__(self, path: str) -> bool:
+        return self.get(path, MISSING) is not MISSING
+
+    def __getitem__(self, path: str) -> Optional[str]:
+        url = self.get(path, MISSING)
+        if url is MISSING:
+            raise KeyError(path)
+        return url
+
+    def url_for_hash(self, digest: str) -> Optional[str]:
+        row = self.db.execute('SELECT url FROM images WHERE hash = ?', (digest,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, path: str, digest: Optional[str], url: Optional[str] = None, size: int = 0) -> None:
+        """Records which image a track uses, and the image's url if it is new. A digest of None means no art."""
+
+        with self.db:
+            self.db.execute('BEGIN')
+            if digest:
+                self.db.execute('INSERT OR IGNORE INTO images VALUES (?, ?, ?)', (digest, url, size))
+            self.db.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?)', (path, digest))
+
+        self.memo[path] = url if digest else None
+
+    def stats(self) -> dict:
+        tracks, referenced_bytes = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks JOIN images USING (hash)').fetchone()
+        images, stored_bytes = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images').fetchone()
+
+        return {
+            'tracks': tracks,
+            'images': images,
+            'ratio': f'{tracks / images if images else 0:.2f}',
+            'saved': referenced_bytes - stored_bytes,
+        }
+
+    def __len__(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class BulkArtUpload:
+    """Uploads the cover art of many tracks with a bounded number of workers.
+    Identical images are only uploaded once, and uploads are spaced out to stay under the channel rate limit.
+    Results are written into `cache` as they finish, so an interrupted run can be resumed from it later."""
+
+    def __init__(self, metadata: MetadataService, upload: Uploader, cache: ArtStore,
+                 concurrency: int = 4, rate: float = 1.0):
+        self.metadata = metadata
+        self.upload = upload
+        self.cache = cache
+        self.concurrency = concurrency
+        self.pacer = Pacer(rate)
+
+        self.by_hash: dict[str, asyncio.Future] = {}
+
+        self.total = 0
+        self.done = 0
+        self.uploaded = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def progress(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'done': self.done,
+            'total': self.total,
+            'uploaded': self.uploaded,
+            'deduplicated': self.deduplicated,
+            'failed': self.failed,
+            'rate': f'{self.done / elapsed if elapsed else 0:.1f}',
+        }
+
+    async def upload_new(self, data: bytes, ext: str) -> str:
+        url = await self.upload(data, ext, self.pacer)
+        self.uploaded += 1
+        return url
+
+    async def upload_unique(self, digest: str, data: bytes, ext: str) -> str:
+        future = self.by_hash.get(digest)
+        if future is None:
+            future = self.by_hash[digest] = asyncio.ensure_future(self.upload_new(data, ext))
+        else:
+            self.deduplicated += 1
+
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # Let a later track with the same art try again
+            if self.by_hash.get(digest) is future:
+                del self.by_hash[digest]
+            raise
+
+    async def process(self, path: str) -> None:
+        track = await self.metadata.get_tags(path)
+        data, ext = await self.metadata.get_art(path) if track.has_art else (None, None)
+
+        if not data:
+            self.cache.add(path, None)
+            return
+
+        digest = art_hash(data)
+        url = self.cache.url_for_hash(digest)
+
+        if url:
+            self.deduplicated += 1
+        else:
+            url = await self.upload_unique(digest, data, ext)
+
+        self.cache.add(path, digest, url, len(data))
+
+    async def worker(self, paths: Iterator[str]) -> None:
+        for path in paths:
+            try:
+                await self.process(path)
+            except Exception as exc:
+                # Failed tracks are left out of the cache so the next run retries them
+                print(f'Failed to cache art for {path}: {exc}')
+                self.failed += 1
+
+            self.done += 1
+
+    async def run(self, paths: list[str], on_progress: Callable[['BulkArtUpload'], Awaitable],
+                  interval: float = 5.0) -> None:
+        """Processes every path, calling `on_progress` every `interval` seconds while running."""
+
+        self.total = len(paths)
+        self.started = time.monotonic()
+
+        iterator = iter(paths)
+        workers = asyncio.gather(*(self.worker(iterator) for _ in range(self.concurrency)))
+
+        try:
+            while not workers.done():
+                await asyncio.wait({workers}, timeout=interval)
+                await on_progress(self)
+        finally:
+            workers.cancel()
+
+        await workers
@@ -0,0 +1,233 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import discord
+
+FRAME_LENGTH = 0.02  # seconds of audio in each frame the voice client reads
+SILENCE = b'\xf8\xff\xfe'  # an Opus frame of silence
+
+
+class QueueSource(discord.AudioSource):
+    """Plays tracks back to back inside a single voice client `play` call.
+    `on_prefetch` is called `prefetch` seconds before the current track ends so the next one can be queued with
+    `queue_next`. Its ffmpeg process is then already running and the switch happens between two frames.
+    Both callbacks run on the audio player's thread."""
+
+    def __init__(self, source: discord.AudioSource, duration: float, on_prefetch: Callable[[], None],
+                 on_switch: Callable[[Any, float], None], prefetch: float = 5.0):
+        self.current = source
+        self.remaining = duration / FRAME_LENGTH
+        self.on_prefetch = on_prefetch
+        self.on_switch = on_switch
+        self.prefetch = prefetch / FRAME_LENGTH
+
+        self.upcoming: Optional[tuple[discord.AudioSource, float, Any]] = None
+        self.requested = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def queue_next(self, source: discord.AudioSource, duration: float, tag: Any) -> None:
+        """Sets the source to switch to once the current one runs out. `tag` is passed to `on_switch`."""
+
+        with self.lock:
+            if self.closed:
+                discarded = source
+            else:
+                discarded = self.upcoming[0] if self.upcoming else None
+                self.upcoming = (source, duration, tag)
+
+        if discarded:
+            discarded.cleanup()
+
+    def discard_next(self) -> None:
+        """Drops the queued source, for when it's no longer valid. A new one is requested on the next frame."""
+
+        with self.lock:
+            upcoming, self.upcoming = self.upcoming, None
+            self.requested = False
+
+        if upcoming:
+            upcoming[0].cleanup()
+
+    def read(self) -> bytes:
+        if not self.requested and self.remaining <= self.prefetch:
+            self.requested = True
+            self.on_prefetch()
+
+        data = self.current.read()
+        if data:
+            self.remaining -= 1
+            return data
+
+        with self.lock:
+            upcoming, self.upcoming = self.upcoming, None
+
+        if upcoming is None:
+            return b''
+
+        self.current.cleanup()
+        self.current, duration, tag = upcoming
+        self.remaining = duration / FRAME_LENGTH
+        self.requested = False
+
+        self.on_switch(tag, time.monotonic())
+        return self.current.read()
+
+    def is_opus(self) -> bool:
+        return self.current.is_opus()
+
+    def cleanup(self) -> None:
+        with self.lock:
+            self.closed = True
+
+        self.current.cleanup()
+        self.discard_next()
+
+
+class Broadcast:
+    """A single Opus source read once and shared by every guild listening to the same track.
+    Packets are pulled from the source by whichever listener is furthest ahead and kept in a ring buffer,
+    the other listeners read them from there at their own positions."""
+
+    def __init__(self, path: str, source: discord.AudioSource, capacity: int):
+        self.path = path
+        self.source = source
+        self.capacity = capacity
+        self.ring: list[bytes] = [b''] * capacity
+        self.produced = 0
+        self.finished = False
+        self.listeners = 0
+        self.lock = threading.Lock()
+
+    def joinable(self) -> bool:
+        """A new listener starts from the first packet, so it can only join while that is still buffered.
+        Half the buffer is kept as slack for listeners that are prefetched and start reading a while later."""
+
+        return self.produced < self.capacity // 2
+
+    def packet(self, index: int) -> Optional[bytes]:
+        """The packet at `index`, empty once the track has ended, or None if it has already left the buffer."""
+
+        with self.lock:
+            while index >= self.produced and not self.finished:
+                packet = self.source.read()
+                if not packet:
+                    self.finished = True
+                    break
+
+                self.ring[self.produced % self.capacity] = packet
+                self.produced += 1
+
+            if index < self.produced - self.capacity:
+                return None
+
+            if index >= self.produced:
+                return b''
+
+            return self.ring[index % self.capacity]
+
+
+class BroadcastListener(discord.AudioSource):
+    """One guild's position in a Broadcast. A listener that falls further behind than the buffer, like one that was
+    paused for a while, carries on from where it was with a source of its own. That source is opened on a thread of
+    its own, since starting ffmpeg would hold up the audio thread, and the listener plays silence until it's ready."""
+
+    def __init__(self, broadcast: Broadcast, hub: 'BroadcastHub',
+                 open_source: Callable[[str, float], discord.AudioSource]):
+        self.broadcast = broadcast
+        self.hub = hub
+        self.open_source = open_source
+        self.index = 0
+        self.source: Optional[discord.AudioSource] = None
+        self.opening = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def read(self) -> bytes:
+        if self.source:
+            return self.source.read()
+
+        if self.opening:
+            return SILENCE
+
+        if not self.broadcast:
+            return b''
+
+        packet = self.broadcast.packet(self.index)
+        if packet is None:
+            broadcast, self.broadcast = self.broadcast, None
+            self.hub.unsubscribe(broadcast)
+
+            self.opening = True
+            threading.Thread(target=self.open_fallback, args=(broadcast.path,), name='broadcast-fallback',
+                             daemon=True).start()
+            return SILENCE
+
+        self.index += 1
+        return packet
+
+    def open_fallback(self, path: str) -> None:
+        try:
+            source = self.open_source(path, self.index * FRAME_LENGTH)
+        except Exception as exc:
+            print(f'Failed to open {path} for a listener that fell behind: {exc}')
+            source = None
+
+        with self.lock:
+            if not self.closed:
+                self.source, source = source, None
+            self.opening = False
+
+        if source:
+            source.cleanup()  # the listener was cleaned up while it was opening
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        with self.lock:
+            self.closed = True
+            source, self.source = self.source, None
+
+        if source:
+            source.cleanup()
+
+        if self.broadcast:
+            self.hub.unsubscribe(self.broadcast)
+            self.broadcast = None
+
+
+class BroadcastHub:
+    """Hands out listeners for tracks, sharing a Broadcast between guilds that start the same track
+    within `buffer` seconds of each other. Decoding cost then grows with distinct tracks, not listeners."""
+
+    def __init__(self, buffer: float = 30.0):
+        self.capacity = round(buffer / FRAME_LENGTH)
+        self.broadcasts: dict[str, Broadcast] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, path: str, open_source: Callable[[str, float], discord.AudioSource]) -> BroadcastListener:
+        """`open_source` must return an Opus source starting at the given position in seconds. It's called when
+        there is no broadcast to join, and for listeners that fall too far behind."""
+
+        with self.lock:
+            broadcast = self.broadcasts.get(path)
+
+            if broadcast is None or not broadcast.joinable():
+                broadcast = self.broadcasts[path] = Broadcast(path, open_source(path, 0.0), self.capacity)
+
+            broadcast.listeners += 1
+
+        return BroadcastListener(broadcast, self, open_source)
+
+    def unsubscribe(self, broadcast: Broadcast) -> None:
+        with self.lock:
+            broadcast.listeners -= 1
+            if broadcast.listeners:
+                return
+
+            if self.broadcasts.get(broadcast.path) is broadcast:
+                del self.broadcasts[broadcast.path]
+
+        broadcast.source.cleanup()
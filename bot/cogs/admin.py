@@ -5,6 +5,7 @@ from discord.ext import commands
 
 from ..lang import send_embed
 from ..main import FunBot
+from ..metrics import metrics
 
 
 class Admin(commands.Cog):
@@ -40,6 +41,23 @@ class Admin(commands.Cog):
         # Get `__ex` from local variables, call it and return the result
         return await locals()['__ex'](ctx)
 
+    @commands.command(name='metrics')
+    @commands.is_owner()
+    async def show_metrics(self, ctx: commands.Context):
+        """Shows the slowest things the bot has timed"""
+
+        await send_embed(ctx, 'admin.metrics', lines='\n'.join(metrics.summary()) or 'Nothing timed yet')
+
+    @commands.command()
+    @commands.is_owner()
+    async def blocking(self, ctx: commands.Context):
+        """Shows the code that blocked the event loop for the longest"""
+
+        if self.bot.watchdog is None:
+            return await send_embed(ctx, 'admin.blocking', lines='The watchdog is turned off')
+
+        await send_embed(ctx, 'admin.blocking', lines='\n'.join(self.bot.watchdog.report()) or 'Nothing blocked yet')
+
     @commands.command()
     @commands.is_owner()
     async def shutdown(self, ctx: commands.Context):
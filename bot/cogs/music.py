@@ -1,19 +1,23 @@
-import base64
-import json
-import os
-import random
+import asyncio
+import time
+import traceback
 from datetime import timedelta
-from glob import glob
 from io import BytesIO
-from typing import Optional, Union
+from typing import Optional
 
 import discord
 from discord.ext import commands, tasks
-from mutagen import File
-from mutagen.flac import FLAC, Picture
 
-from ..lang import send_embed
-from ..main import ClientData, FunBot
+from ..artcache import ArtStore, BulkArtUpload, art_hash
+from ..audio import BroadcastHub, QueueSource
+from ..lang import catalog, send_embed
+from ..library import MusicLibrary
+from ..main import FunBot
+from ..metadata import MetadataService, TrackInfo
+from ..opuscache import OpusCache
+from ..outbox import Pacer, Priority, outbox
+from ..playback import PlaybackStore, SavedPlayback
+from ..progress import BarScheduler, create_bar
 
 
 def connect_ensure_voice():
@@ -38,100 +42,76 @@ def ensure_voice():
     return commands.check(predicate)
 
 
-def dir_list() -> set: return set(x[6:-1].lower() for x in glob("music/*/"))
-
-
-def timedelta_to_str(time: timedelta) -> str:
-    output = str(time).split(':', 1)[1]
-    if output[0] == '0':
-        output = output[1:]
-
-    return output
-
-
-def create_bar(current_time: timedelta, total_time: timedelta) -> str:
-    str_current_time = timedelta_to_str(current_time)
-    str_total_time = timedelta_to_str(total_time)
-
-    start = round(current_time / total_time * 30)
-    bar = '▬' * start + '🔘' + '▬' * (29 - start)
-
-    return f'`{str_current_time} {bar} {str_total_time}`'
-
-
-async def update_bar(client_data: ClientData) -> None:
-    if not client_data.message:
-        return
-
-    embed: discord.Embed = client_data.message.embeds[0]
-    index = len(embed.fields) - 1
-
-    file_ = File(client_data.now_playing)
-    total_length = timedelta(seconds=file_.info.length//1)
-
-    new_bar = create_bar(client_data.timestamp, total_length)
-    embed.set_field_at(index, name="** **", value=new_bar)
-
-    try:
-        await client_data.message.edit(embed=embed)
-    except discord.NotFound:
-        pass
-
-
-def set_if_exists(embed: discord.Embed, name: str, value: Union[list[str], str, float], inline=True) -> None:
+def set_if_exists(embed: discord.Embed, name: str, value: str, inline=True) -> None:
     if not value:
         return
 
-    if isinstance(value, list):
-        value = value[0]
-
     embed.add_field(name=name, value=value, inline=inline)
 
 
-def get_art(file_) -> tuple[Picture, str]:
-    extensions = {
-        "image/jpeg": "jpg",
-        "image/png": "png",
-        "image/gif": "gif",
-    }
-
-    picture = None
-
-    if isinstance(file_, FLAC):
-        picture = file_.pictures[0]
-        ext = extensions.get(picture.mime, "jpg")
-        return picture, ext
-
-    for b64_data in file_.get("metadata_block_picture", []):
-        picture = Picture(base64.b64decode(b64_data))
-        ext = extensions.get(picture.mime, "jpg")
-
-    return picture, ext
-
+def report_failure(future: asyncio.Future) -> None:
+    """Prints what went wrong in a coroutine the audio player's thread scheduled, since nothing awaits it."""
 
-def load_cache() -> dict[str, str]:
-    if not os.path.exists('cache.json'):
-        return {}
-
-    with open('cache.json', 'r') as file:
-        return json.load(file)
-
-
-def save_cache(cache: dict[str, str]) -> None:
-    with open('cache.json', 'w+') as file:
-        json.dump(cache, file, indent=4)
+    if not future.cancelled() and future.exception():
+        exc = future.exception()
+        print(f'Player callback failed: {exc!r}')
+        traceback.print_exception(type(exc), exc, exc.__traceback__)
 
 
 class Music(commands.Cog):
     def __init__(self, bot: FunBot):
         self.bot = bot
 
+        self.bars = BarScheduler(self.bot.get_channel)
         self.bar_update_loop.start()
-        self.music_loop.start()
         self.music_data = self.bot.music_data
-
-        self.cache_channel: discord.TextChannel = self.bot.get_channel(self.bot.config['Bot']['cache_channel'])
-        self.cache = load_cache()
+        self.starting: set[int] = set()  # guilds that are in the middle of starting a song
+
+        self.cache = ArtStore('art_cache.db')
+        music_config = self.bot.config.get('Music', {})
+        self.metadata = MetadataService(workers=music_config.get('metadata_workers', 4))
+        self.opus_cache = OpusCache(music_config['opus_cache']) if music_config.get('opus_cache') else None
+
+        self.broadcasts = None
+        if music_config.get('broadcast'):
+            self.broadcasts = BroadcastHub(music_config.get('broadcast_buffer', 30.0))
+
+        self.library = MusicLibrary('music')  # empty until startup has scanned the music folder
+        self.library_watcher: Optional[asyncio.Task] = None
+        self.playback = PlaybackStore('playback.db')
+        self.restore_task: Optional[asyncio.Task] = None
+
+    async def startup(self):
+        """Scans the music folder on another thread and imports the old art cache, while the bot connects.
+        Playback is only restored after the scan, since it needs to know which tracks still exist."""
+
+        library = MusicLibrary('music')
+        await asyncio.get_running_loop().run_in_executor(None, library.scan)
+
+        library.on_change = self.resize_group
+        self.library = library
+        self.library_watcher = self.bot.loop.create_task(library.watch())
+
+        self.cache.migrate_json('cache.json')
+        self.restore_task = self.bot.loop.create_task(self.restore_playback())
+
+    def cog_unload(self):
+        self.bar_update_loop.cancel()
+        for task in (self.library_watcher, self.restore_task):
+            if task:
+                task.cancel()
+        self.playback.close()
+        self.metadata.shutdown()
+        if self.opus_cache:
+            self.opus_cache.shutdown()
+        self.cache.close()
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
+                                    after: discord.VoiceState):
+        # Kicked, moved out by a disconnect or left by the bot itself, either way there's nothing to rejoin
+        if member.id == self.bot.user.id and before.channel and not after.channel:
+            self.playback.delete(member.guild.id)
 
     @commands.command(aliases=['j'])
     async def join(self, ctx: commands.Context) -> bool:
@@ -149,7 +129,8 @@ class Music(commands.Cog):
                 await ctx.author.voice.channel.connect()
 
             await send_embed(ctx, 'music.join')
-            self.music_data[ctx.guild.id].channel = ctx.channel
+            self.bot.client_data(ctx.guild.id).channel_id = ctx.channel.id
+            self.playback.save_channels(ctx.guild.id, ctx.author.voice.channel.id, ctx.channel.id)
             return True
         else:
             await send_embed(ctx, "music.error.user_not_connected")
@@ -161,7 +142,8 @@ class Music(commands.Cog):
         """Disconnects the bot from the voice channel and clears the queue."""
 
         await ctx.voice_client.disconnect()
-        self.music_data.pop(ctx.guild.id)  # remove the data for this isntance
+        self.music_data.pop(ctx.guild.id, None)  # remove the data for this isntance
+        self.playback.delete(ctx.guild.id)
 
         await send_embed(ctx, 'music.leave')
 
@@ -169,7 +151,7 @@ class Music(commands.Cog):
     async def list(self, ctx: commands.Context):
         """Lists all the possible song groups that you can add to the queue."""
 
-        await send_embed(ctx, 'music.list', groups=sorted(dir_list()))
+        await send_embed(ctx, 'music.list', groups=sorted(self.library.group_names()))
 
     @connect_ensure_voice()
     @commands.command(aliases=['p'])
@@ -184,7 +166,7 @@ class Music(commands.Cog):
             await send_embed(ctx, 'music.error.no_arg', arg="play")
             return
 
-        queue = self.music_data[ctx.guild.id].queue
+        queue = self.bot.client_data(ctx.guild.id).queue
         added = []
         invalid = []
         already_queued = []
@@ -194,8 +176,8 @@ class Music(commands.Cog):
 
             if group in queue:
                 already_queued.append(group)
-            elif group in dir_list():
-                queue.add(group)
+            elif group in self.library:
+                queue.add(group, len(self.library.tracks(group)))
                 added.append(group)
             else:
                 invalid.append(group)
@@ -205,15 +187,24 @@ class Music(commands.Cog):
         if already_queued:
             await send_embed(ctx, 'music.error.already_queued', groups=already_queued)
         if added:
+            self.playback.save_queue(ctx.guild.id, queue)
             await send_embed(ctx, 'music.queued', groups=added)
+            await self.play_next(ctx.guild.id)
 
     @connect_ensure_voice()
     @commands.command(name='playall', aliases=['pa'])
     async def play_all(self, ctx: commands.Context):
         """Adds all song groups to the queue"""
 
-        self.music_data[ctx.guild.id].queue = dir_list()
-        await send_embed(ctx, 'music.queued', groups=dir_list())
+        queue = self.bot.client_data(ctx.guild.id).queue
+        groups = self.library.group_names()
+
+        for group in groups:
+            queue.add(group, len(self.library.tracks(group)))
+
+        self.playback.save_queue(ctx.guild.id, queue)
+        await send_embed(ctx, 'music.queued', groups=groups)
+        await self.play_next(ctx.guild.id)
 
     @ensure_voice()
     @commands.command()
@@ -224,6 +215,9 @@ class Music(commands.Cog):
             await send_embed(ctx, 'music.error.already_paused')
         else:
             ctx.voice_client.pause()
+            client_data = self.bot.client_data(ctx.guild.id)
+            client_data.pause_timer()
+            self.playback.save_pause(ctx.guild.id, client_data.position)
             await send_embed(ctx, 'music.pause')
 
     @ensure_voice()
@@ -233,6 +227,9 @@ class Music(commands.Cog):
 
         if ctx.voice_client.is_paused():
             ctx.voice_client.resume()
+            client_data = self.bot.client_data(ctx.guild.id)
+            client_data.resume_timer()
+            self.playback.save_resume(ctx.guild.id, client_data.position)
             await send_embed(ctx, 'music.resume')
         else:
             await send_embed(ctx, 'music.error.already_playing')
@@ -242,7 +239,7 @@ class Music(commands.Cog):
     async def skip(self, ctx: commands.Context):
         """Skips the current song."""
 
-        # stopping the client makes the task think that a song has finished
+        # stopping the client calls the after callback, which starts a new song
         ctx.voice_client.stop()
         await send_embed(ctx, 'music.skipped')
 
@@ -255,7 +252,7 @@ class Music(commands.Cog):
             await send_embed(ctx, 'music.error.no_arg', arg="remove")
             return
 
-        queue = self.music_data[ctx.guild.id].queue
+        queue = self.bot.client_data(ctx.guild.id).queue
         removed = []
         invalid = []
 
@@ -271,6 +268,8 @@ class Music(commands.Cog):
         if invalid:
             await send_embed(ctx, 'music.error.remove_fail', groups=invalid)
         if removed:
+            self.playback.save_queue(ctx.guild.id, queue)
+            self.discard_prefetched(ctx.guild)
             await send_embed(ctx, 'music.removed', groups=removed)
 
     @ensure_voice()
@@ -278,7 +277,9 @@ class Music(commands.Cog):
     async def clear(self, ctx: commands.Context):
         """Clears the queue."""
 
-        self.music_data[ctx.guild.id].queue = set()
+        self.bot.client_data(ctx.guild.id).queue.clear()
+        self.playback.save_queue(ctx.guild.id, [])
+        self.discard_prefetched(ctx.guild)
         await send_embed(ctx, 'music.clear')
 
     @ensure_voice()
@@ -286,124 +287,342 @@ class Music(commands.Cog):
     async def now_playing(self, ctx: commands.Context):
         """Displays the currently playing song."""
 
-        path = self.music_data[ctx.guild.id].now_playing
-        timestamp = self.music_data[ctx.guild.id].timestamp
+        client_data = self.music_data.get(ctx.guild.id)
 
-        if not path:
+        if not client_data or not client_data.track:
             await send_embed(ctx, 'music.error.nothing_playing', prefix=ctx.prefix)
             return
 
-        embed = await self.make_np_embed(path, timestamp)
-        await ctx.send(embed=embed)
-
-    async def make_np_embed(self, path: str, timestamp: timedelta) -> discord.Embed:
-        file_ = File(path)
-
-        total_length = timedelta(seconds=file_.info.length//1)
-
-        title = file_.get('title', path)
-        if isinstance(title, list):
-            title = title[0]
+        embed = await self.make_np_embed(client_data.track, client_data.timestamp)
+        await outbox.send(ctx, embed=embed)
 
-        embed = discord.Embed(title=title, colour=discord.Colour.random())
+    async def make_np_embed(self, track: TrackInfo, timestamp: timedelta) -> discord.Embed:
+        embed = discord.Embed(title=track.title, colour=discord.Colour.random())
 
-        set_if_exists(embed, name='Artist', value=file_.get('artist'))
-        set_if_exists(embed, name='Album', value=file_.get('album'))
-        set_if_exists(embed, name='Track', value=file_.get('tracknumber'))
+        set_if_exists(embed, name='Artist', value=track.artist)
+        set_if_exists(embed, name='Album', value=track.album)
+        set_if_exists(embed, name='Track', value=track.track_number)
 
-        embed.add_field(name='** **', value=create_bar(timestamp, total_length))
-        embed.set_thumbnail(url=await self.get_cache_url(path))
+        embed.add_field(name='** **', value=create_bar(timestamp, track.duration))
+        embed.set_thumbnail(url=await self.get_cache_url(track))
 
         return embed
 
-    async def get_cache_url(self, path: str) -> Optional[str]:
+    async def get_cache_url(self, track: TrackInfo) -> Optional[str]:
+        path = track.path
         if path in self.cache:
             return self.cache[path]
 
-        file_ = File(path)
-        picture, ext = get_art(file_)
+        data, ext = await self.metadata.get_art(path) if track.has_art else (None, None)
 
-        if picture:
-            file = discord.File(BytesIO(picture.data), filename=f'cover.{ext}')
-            message: discord.Message = await self.cache_channel.send(file=file)
-            self.cache[path] = message.attachments[0].url
-        else:
-            self.cache[path] = None
+        if not data:
+            self.cache.add(path, None)
+            return None
+
+        # Tracks sharing the same picture, like an album, only upload it once
+        digest = art_hash(data)
+        url = self.cache.url_for_hash(digest) or await self.upload_art(data, ext)
+
+        self.cache.add(path, digest, url, len(data))
+        return url
 
-        save_cache(self.cache)
-        return self.cache[path]
+    @property
+    def cache_channel(self) -> discord.TextChannel:
+        return self.bot.get_channel(self.bot.config['Bot']['cache_channel'])
+
+    async def upload_art(self, data: bytes, ext: str, pacer: Optional[Pacer] = None) -> str:
+        file = discord.File(BytesIO(data), filename=f'cover.{ext}')
+        message: discord.Message = await outbox.send(self.cache_channel, Priority.BULK, pacer, file=file)
+        return message.attachments[0].url
 
     @commands.is_owner()
     @commands.command()
     async def populate_cache(self, ctx: commands.Context):
-        """Admin-only command to populate the cache."""
+        """Admin-only command to populate the cache.
+        Tracks that are already cached are skipped, so an interrupted run can just be started again."""
+
+        songs = [song for group in self.library.group_names() for song in self.library.tracks(group)
+                 if song not in self.cache]
+
+        music_config = self.bot.config.get('Music', {})
+        upload = BulkArtUpload(self.metadata, self.upload_art, self.cache,
+                               concurrency=music_config.get('upload_concurrency', 4),
+                               rate=music_config.get('upload_rate', 1.0))
+        upload.total = len(songs)
+
+        message = await send_embed(ctx, 'music.populate_cache.progress', **upload.progress())
+
+        async def report(progress: BulkArtUpload):
+            try:
+                await outbox.edit(message.channel, message.id, Priority.BULK,
+                                  embed=catalog['music.populate_cache.progress'].make_embed(**progress.progress()))
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as exc:
+                # A failed progress edit shouldn't stop the upload, the next report tries again
+                print(f'Failed to update the populate_cache progress: {exc}')
+
+        await upload.run(songs, report)
+        await send_embed(ctx, 'music.populate_cache.done', **upload.progress())
+
+    @commands.is_owner()
+    @commands.command()
+    async def build_opus_cache(self, ctx: commands.Context):
+        """Admin-only command to encode every track into the Opus cache ahead of time."""
+
+        if not self.opus_cache:
+            await send_embed(ctx, 'music.error.opus_cache_disabled')
+            return
+
+        songs = [song for group in self.library.group_names() for song in self.library.tracks(group)]
+        await send_embed(ctx, 'music.opus_cache.started', total=len(songs))
+
+        encoded = await self.opus_cache.build_all(songs)
+        await send_embed(ctx, 'music.opus_cache.done', encoded=encoded, total=len(songs))
+
+    @commands.is_owner()
+    @commands.command()
+    async def bar_stats(self, ctx: commands.Context):
+        """Admin-only command that shows how the now playing bars are being updated."""
 
-        songs = [song for group in dir_list() for song in glob(f'music/{group}/*')]
-        urls = [await self.get_cache_url(song) for song in songs]
-        await ctx.send(len(urls))
+        await send_embed(ctx, 'music.bar_stats', **self.bars.stats())
+
+    @commands.is_owner()
+    @commands.command()
+    async def art_stats(self, ctx: commands.Context):
+        """Admin-only command that shows how much the art cache saves by sharing identical images."""
+
+        stats = self.cache.stats()
+        await send_embed(ctx, 'music.art_stats', tracks=stats['tracks'], images=stats['images'],
+                         ratio=stats['ratio'], saved=f"{stats['saved'] / 1024 / 1024:.1f} MiB")
 
     @ensure_voice()
     @commands.command(aliases=['q'])
     async def queue(self, ctx: commands.Context):
         """Displays the current groups in the queue"""
 
-        queue = sorted(self.music_data[ctx.guild.id].queue)
+        client_data = self.music_data.get(ctx.guild.id)
+
+        queue = sorted(client_data.queue) if client_data else []
         if queue:
             await send_embed(ctx, 'music.queue', groups=queue)
         else:
             await send_embed(ctx, 'music.queue_empty')
 
-    @tasks.loop(seconds=1)
-    async def music_loop(self):
-        for client in self.bot.voice_clients:
-            client_data = self.music_data[client.guild.id]
+    def resize_group(self, group: str) -> None:
+        """Keeps the queues' weights in sync when the library watcher adds or removes tracks."""
 
-            if client.is_playing():
-                client_data.timestamp += timedelta(seconds=1)
-                continue
+        size = len(self.library.tracks(group))
+        for client_data in self.music_data.values():
+            client_data.queue.resize(group, size)
 
-            if client.is_paused():
-                continue
+    def run_threadsafe(self, method: str, *args) -> None:
+        """Schedules one of the cog's coroutines on the bot's loop from the audio player's thread.
+        Players outlive the cog that started them when it's reloaded, so the method is looked up on whichever
+        Music cog is loaded once it runs."""
 
-            if not client_data.queue:
-                client_data.now_playing = None
-                continue
+        future = asyncio.run_coroutine_threadsafe(self.call_loaded(method, *args), self.bot.loop)
+        future.add_done_callback(report_failure)
 
-            # Get a list of all the possible songs to play
-            groups = [glob(f"music/{group}/*") for group in client_data.queue]
-            songs = [song for group in groups for song in group]
+    async def call_loaded(self, method: str, *args) -> None:
+        cog: Optional[Music] = self.bot.get_cog(self.qualified_name)
+        if cog is not None:
+            await getattr(cog, method)(*args)
 
-            # prevent the current song from being played twice in a row
-            if client_data.now_playing in songs:
-                songs.remove(client_data.now_playing)
+    def after_track(self, guild_id: int, error: Optional[Exception]) -> None:
+        """Called from the audio player's thread when the queue source runs out or is stopped."""
 
-            client_data.now_playing = random.choice(songs)
+        if error:
+            print(f'Player error: {error}')
 
-            source = discord.FFmpegPCMAudio(client_data.now_playing)
-            client.play(source, after=lambda e: print(f'Player error: {e}') if e else None)
+        self.run_threadsafe('play_next', guild_id)
 
-            # Reset the timestamp
-            client_data.timestamp = timedelta()
+    def open_source(self, path: str, position: float = 0.0, duration: Optional[float] = None) -> discord.AudioSource:
+        if self.opus_cache:
+            return self.opus_cache.source(path, position, duration)
+
+        before_options = f'-ss {position:.2f}' if position else None
+
+        if self.broadcasts:
+            return discord.FFmpegOpusAudio(path, before_options=before_options)
+
+        return discord.FFmpegPCMAudio(path, before_options=before_options)
+
+    def make_source(self, path: str, duration: float, position: float = 0.0) -> discord.AudioSource:
+        if self.broadcasts and not position:
+            # Guilds starting the same track around the same time share one decoder
+            return self.broadcasts.subscribe(path, lambda path, position: self.open_source(path, position, duration))
+
+        return self.open_source(path, position, duration)
+
+    async def play_next(self, guild_id: int) -> None:
+        """Starts playing random songs from the queue, unless something is already playing or the queue is empty.
+        Following songs are prefetched into the same QueueSource, this only runs again once that runs dry."""
+
+        guild = self.bot.get_guild(guild_id)
+        client: Optional[discord.VoiceClient] = guild and guild.voice_client
+
+        client_data = self.music_data.get(guild_id)
+
+        if not client or not client.is_connected() or client_data is None:
+            return
+
+        if client.is_playing() or client.is_paused() or guild_id in self.starting:
+            return
+
+        # A song that was prefetched and thrown away, by a skip for example, is still the next one to play
+        path, client_data.upcoming = client_data.upcoming, None
+        if not path or not self.library.has_track(path):
+            path = client_data.queue.choose(self.library)
+
+        if not path:
+            client_data.track = None
+            client_data.embed = None
+            self.playback.save_track(guild_id, None)
+            return
+
+        await self.start_track(guild_id, client, path)
+
+    async def start_track(self, guild_id: int, client: discord.VoiceClient, path: str, position: float = 0.0) -> None:
+        self.starting.add(guild_id)
+        try:
+            track = await self.metadata.get_tags(path)
+
+            source = QueueSource(
+                self.make_source(path, track.duration.total_seconds(), position),
+                track.duration.total_seconds() - position,
+                on_prefetch=lambda: self.run_threadsafe('prefetch', guild_id),
+                on_switch=lambda next_track, started: self.run_threadsafe(
+                    'track_started', guild_id, next_track, started),
+            )
+            client.play(source, after=lambda e: self.after_track(guild_id, e))
+        finally:
+            self.starting.discard(guild_id)
+
+        await self.track_started(guild_id, track, time.monotonic() - position)
+
+    async def restore_playback(self) -> None:
+        """Reconnects to every guild that was playing before the bot restarted, all at the same time."""
+
+        await self.bot.wait_until_ready()
+
+        saved = self.playback.load()
+        results = await asyncio.gather(*(self.restore_guild(playback) for playback in saved), return_exceptions=True)
+
+        for playback, result in zip(saved, results):
+            if isinstance(result, Exception):
+                print(f'Failed to restore playback in {playback.guild_id}: {result}')
+
+    async def restore_guild(self, saved: SavedPlayback) -> None:
+        guild = self.bot.get_guild(saved.guild_id)
+
+        # Still connected means only the cog was reloaded, and the bot's music data is still there
+        if guild is None or guild.voice_client:
+            return
+
+        voice_channel = guild.get_channel(saved.voice_channel_id)
+        text_channel = guild.get_channel(saved.text_channel_id)
+
+        if voice_channel is None or text_channel is None:
+            self.playback.delete(saved.guild_id)
+            return
+
+        client = await voice_channel.connect()
+
+        client_data = self.bot.client_data(saved.guild_id)
+        client_data.channel_id = text_channel.id
+        client_data.message_id = saved.message_id
+
+        for group in saved.queue:
+            if group in self.library:
+                client_data.queue.add(group, len(self.library.tracks(group)))
+
+        if saved.now_playing and self.library.has_track(saved.now_playing):
+            track = await self.metadata.get_tags(saved.now_playing)
+
+            if saved.position < track.duration.total_seconds():
+                await self.start_track(saved.guild_id, client, saved.now_playing, saved.position)
+
+                if saved.paused:
+                    client.pause()
+                    client_data.pause_timer()
+                    self.playback.save_pause(saved.guild_id, client_data.position)
+                return
+
+        await self.play_next(saved.guild_id)
+
+    async def prefetch(self, guild_id: int) -> None:
+        """Picks the next song and starts its ffmpeg process before the current song ends."""
+
+        guild = self.bot.get_guild(guild_id)
+        client: Optional[discord.VoiceClient] = guild and guild.voice_client
+
+        client_data = self.music_data.get(guild_id)
+
+        if not client or not isinstance(client.source, QueueSource) or client_data is None:
+            return
+
+        path = client_data.queue.choose(self.library)
+        if not path:
+            return
+
+        client_data.upcoming = path
+        track = await self.metadata.get_tags(path)
+        duration = track.duration.total_seconds()
+        client.source.queue_next(self.make_source(path, duration), duration, track)
+
+    def discard_prefetched(self, guild: discord.Guild) -> None:
+        """Forgets the prefetched song after the queue changes, so a new one is picked from the new queue."""
+
+        client_data = self.music_data.get(guild.id)
+        if client_data is not None:
+            client_data.upcoming = None
+
+        if guild.voice_client and isinstance(guild.voice_client.source, QueueSource):
+            guild.voice_client.source.discard_next()
+
+    async def track_started(self, guild_id: int, track: TrackInfo, started: Optional[float] = None) -> None:
+        client_data = self.music_data.get(guild_id)
+        if client_data is None:
+            return
+
+        if client_data.upcoming == track.path:
+            client_data.upcoming = None
+
+        client_data.track = track
+        client_data.queue.remember(track.path)
+        client_data.start_timer(started)
+        self.playback.save_track(guild_id, track.path, client_data.position)
+
+        channel: Optional[discord.TextChannel] = self.bot.get_channel(client_data.channel_id)
+        if channel is None:
+            return
 
-            # Send a np message for the song that just started playing
-            embed = await self.make_np_embed(client_data.now_playing, client_data.timestamp)
+        # Send a np message for the song that just started playing
+        embed = await self.make_np_embed(client_data.track, client_data.timestamp)
 
-            if client_data.message:
-                await client_data.message.delete()
+        if client_data.message_id:
+            try:
+                await outbox.delete(channel, client_data.message_id, Priority.NOW_PLAYING)
+            except discord.NotFound:
+                pass
 
-            client_data.message = await client_data.channel.send(embed=embed)
+        message = await outbox.send(channel, Priority.NOW_PLAYING, embed=embed)
+        client_data.message_id = message.id
+        client_data.embed = embed
+        self.playback.save_message(guild_id, message.id)
 
     @tasks.loop(seconds=5)
     async def bar_update_loop(self):
-        for client in self.bot.voice_clients:
-            if not client.is_playing():
-                continue
+        playing = [client_data for client in self.bot.voice_clients
+                   if client.is_playing() and (client_data := self.music_data.get(client.guild.id))]
 
-            client_data = self.music_data[client.guild.id]
+        interval = self.bars.interval_for(len(playing))
+        if interval != self.bar_update_loop.seconds:
+            self.bar_update_loop.change_interval(seconds=interval)
 
-            await update_bar(client_data)
+        await self.bars.run_pass(playing, interval)
 
-    @music_loop.before_loop
     @bar_update_loop.before_loop
     async def before_music(self):
         await self.bot.wait_until_ready()
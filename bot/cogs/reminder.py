@@ -1,30 +1,55 @@
-import json
-from datetime import datetime
+from typing import Optional
 
 from discord import Color, Embed
-from discord.ext import commands, tasks
+from discord.ext import commands
 
+from ..delivery import DirectMessageFanOut
+from ..lang import send_embed
 from ..main import FunBot
+from ..registrations import Registration, RegistrationStore
+from ..schedule import DEFAULT_TIMETABLE, ReminderIndex, TimerHeap, Timetable, format_time, sleep_until
 
 
 class Reminder(commands.Cog):
     def __init__(self, bot: FunBot):
         self.bot = bot
-        self.main_loop.start()
         self.reminder_enabled = True
 
+        reminder_config = self.bot.config.get('Reminder', {})
+
+        # Guilds without a timetable of their own use the default one
+        timetables = reminder_config.get('timetables') or {}
+        self.timetables = {str(name): Timetable(**timetable) for name, timetable in timetables.items()}
+        self.timetables.setdefault('default', Timetable(**DEFAULT_TIMETABLE))
+
+        self.registrations = RegistrationStore('registrations.db')
+        self.registrations.migrate_json('user_data.json')
+
+        self.indexes = {name: ReminderIndex(timetable) for name, timetable in self.timetables.items()}
+        for user_id, registration in self.registrations.items():
+            self.index_for(registration.guild_id).add(user_id, registration)
+
+        self.dm_concurrency = reminder_config.get('dm_concurrency', 10)
+        self.dm_rate = reminder_config.get('dm_rate', 20.0)
+        self.last_run = DirectMessageFanOut(self.bot.get_user).stats()
+
+        self.main_task = self.bot.loop.create_task(self.main_loop())
+
         self.numbers = ["0️⃣", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣"]
         self.check_x = ["✔️", "✖️"]
         self.color = self.bot.color
 
+    def timetable_name(self, guild_id: Optional[int]) -> str:
+        return str(guild_id) if str(guild_id) in self.timetables else 'default'
+
+    def index_for(self, guild_id: Optional[int]) -> ReminderIndex:
+        return self.indexes[self.timetable_name(guild_id)]
+
     @commands.command()
     async def register(self, ctx: commands.Context):
         """Register yourself for the notifications."""
 
-        with open("user_data.json", "r+") as file:
-            file_data = json.load(file)
-
-        if str(ctx.author.id) in file_data:  # Give error if the user is already registered
+        if ctx.author.id in self.registrations:  # Give error if the user is already registered
             embed = Embed(description="You are already registered! Do `&unregister` to unregister first.",
                           color=Color.red())
             await ctx.send(embed=embed)
@@ -59,15 +84,17 @@ class Reminder(commands.Cog):
         print(user_data)"""
 
         # Ask the user what their lunch period is
+        timetable = self.timetables[self.timetable_name(ctx.guild.id)]
+        lunch_periods = "\n".join(f"Period {self.numbers[period]} starts at {format_time(timetable.starts[period])}"
+                                  for period in timetable.lunch_periods)
         message = await ctx.send(embed=Embed(title="Setup 1/2", color=self.color,
-                                             description="What is your lunch period?\n"
-                                                         "Period 5️⃣ starts at 12:15\n"
-                                                         "Period 6️⃣ starts at 1:10"))
-        for emoji in self.numbers[5:7]:
+                                             description=f"What is your lunch period?\n{lunch_periods}"))
+        offered = [self.numbers[period] for period in timetable.lunch_periods]
+        for emoji in offered:
             await message.add_reaction(emoji)
 
         def check(r, u):
-            return r.emoji in self.numbers and u == ctx.author
+            return r.message.id == message.id and r.emoji in offered and u == ctx.author
 
         reaction, user = await self.bot.wait_for("reaction_add", check=check)
         user_data["lunch_period"] = self.numbers.index(reaction.emoji)
@@ -82,7 +109,7 @@ class Reminder(commands.Cog):
             await message.add_reaction(emoji)
 
         def check_x(r, u):
-            return r.emoji in self.check_x and u == ctx.author
+            return r.message.id == message.id and r.emoji in self.check_x and u == ctx.author
 
         reaction, user = await self.bot.wait_for("reaction_add", check=check_x)
         user_data["every_day"] = reaction.emoji == self.check_x[0]
@@ -92,18 +119,18 @@ class Reminder(commands.Cog):
         await message.edit(embed=Embed(title="Setup Complete!", color=Color.green(),
                                        description="You have been registered successfully."))
 
-        file_data[str(ctx.author.id)] = user_data
+        registration = Registration(user_data["lunch_period"], user_data["every_day"], ctx.guild.id)
+        self.registrations.add(ctx.author.id, registration)
 
-        with open("user_data.json", "w+") as file:
-            json.dump(file_data, file, indent=4)
+        # A register that overlapped this one, maybe in another guild, may have indexed them already
+        for index in self.indexes.values():
+            index.remove(ctx.author.id)
+        self.index_for(ctx.guild.id).add(ctx.author.id, registration)
 
     @commands.command()
     async def unregister(self, ctx: commands.Context):
         """Unregister yourself from the bot."""
-        with open("user_data.json", "r+") as file:
-            file_data = json.load(file)
-
-        if str(ctx.author.id) not in file_data:
+        if ctx.author.id not in self.registrations:
             await ctx.send(embed=Embed(description="You have not been registered yet! "
                                                    "Do `&register` to register first.", color=Color.red()))
             return
@@ -119,11 +146,10 @@ class Reminder(commands.Cog):
         reaction, user = await self.bot.wait_for("reaction_add", check=check_x)
 
         if reaction.emoji == self.check_x[0]:
-            file_data.pop(str(ctx.author.id))
-
-            with open("user_data.json", "w+") as file:
-                json.dump(file_data, file, indent=4)
-
+            registration = self.registrations.get(ctx.author.id)
+            if registration:
+                self.registrations.remove(ctx.author.id)
+                self.index_for(registration.guild_id).remove(ctx.author.id)
             await message.edit(embed=Embed(title="Successfully unregistered!", color=Color.green()))
         else:
             await message.edit(embed=Embed(title="Successfully canceled.", color=Color.red()))
@@ -131,17 +157,15 @@ class Reminder(commands.Cog):
     @commands.command()
     async def view(self, ctx: commands.Context):
         """View your current registration data."""
-        with open("user_data.json", "r+") as file:
-            file_data = json.load(file)
+        registration = self.registrations.get(ctx.author.id)
 
-        if str(ctx.author.id) not in file_data:
+        if registration is None:
             await ctx.send("You have not been registered yet! Do `&register` to register.")
             return
 
-        user_data = file_data[str(ctx.author.id)]
-        elective = "with" if user_data['every_day'] else "without"
+        elective = "with" if registration.every_day else "without"
         embed = Embed(description=f"You are currently registered with your lunch period as "
-                                  f"**period {user_data['lunch_period']}** **{elective}** electives every day.",
+                                  f"**period {registration.lunch_period}** **{elective}** electives every day.",
                       color=self.color)
         embed.set_author(name=f"{ctx.author.display_name}#{ctx.author.discriminator}", icon_url=ctx.author.avatar_url)
         await ctx.send(embed=embed)
@@ -154,46 +178,50 @@ class Reminder(commands.Cog):
         message = "Reminder enabled!" if self.reminder_enabled else "Reminder disabled!"
         await ctx.send(message)
 
-    @tasks.loop(minutes=1.0)
+    @commands.is_owner()
+    @commands.command()
+    async def reminder_stats(self, ctx: commands.Context):
+        """Admin-only command that shows how the last round of reminders was delivered."""
+
+        await send_embed(ctx, 'reminder.stats', **self.last_run)
+
     async def main_loop(self):
-        if not self.reminder_enabled:
-            return
+        """Sleeps until the next reminder of any timetable is due, instead of waking up every minute to check.
+        Reminders are sent in the background, so a big round doesn't hold up another timetable's next one."""
 
-        now = datetime.now()  # Get's the current time.
-        weekday = now.weekday()  # Find the day of the week, needed later.
-        now = now.hour * 60 + now.minute - 514  # I used the number of minutes since the first period for calculations.
-
-        if now % 55 == 0 and (weekday not in [5, 6]):  # Makes sure that it's been exactly a period amount of minutes.
-            period = now // 55 + 1  # Calculate what period it is.
-            print(f"Currently period {period}.")
-
-            # We need the user data of each user, so read from file.
-            with open("user_data.json", "r+") as file:
-                file_data = json.load(file)
-
-            for user_id, user_data in file_data.items():
-                embed = Embed(title="Class starting!",
-                              description=f"Period {period} is staring in one minute! Get ready for class!",
-                              color=Color.green())
-
-                user = self.bot.get_user(int(user_id))
-                elective = 5 if user_data['lunch_period'] == 6 else 6
-
-                if user_data['lunch_period'] == period:  # we don't want to ping on lunch periods
-                    pass
-                elif elective == period:  # If the period is an elective period...
-                    if weekday == 0 or user_data['every_day']:  # Only ping on Mondays, or if they have every day
-                        await user.send(embed=embed)
-                elif 1 <= period <= 8:
-                    await user.send(embed=embed)
-
-    # Makes sure the bot is ready before starting loop
-    @main_loop.before_loop
-    async def before_main(self):
         await self.bot.wait_until_ready()
+        timers = TimerHeap(self.timetables)
+
+        while (when := timers.peek()) is not None:
+            await sleep_until(when)
+            name, period, weekday = timers.pop()
+
+            if self.reminder_enabled:
+                self.bot.loop.create_task(self.send_reminders(name, period, weekday))
+
+    async def send_reminders(self, name: str, period: int, weekday: int):
+        print(f"Currently period {period} in timetable {name}.")
+
+        minutes = self.timetables[name].remind_before
+        embed = Embed(title="Class starting!",
+                      description=f"Period {period} is staring in {minutes} minute{'s' if minutes != 1 else ''}! "
+                                  f"Get ready for class!",
+                      color=Color.green())
+
+        fan_out = DirectMessageFanOut(self.bot.get_user, concurrency=self.dm_concurrency, rate=self.dm_rate)
+        try:
+            self.last_run = await fan_out.run(self.indexes[name].recipients(period, weekday), embed)
+        except Exception as exc:
+            print(f"Failed to send reminders for period {period} in timetable {name}: {exc}")
+            return
+
+        stats = self.last_run
+        print(f"Reminded {stats['sent']}/{stats['total']} users for period {period}, latency p50 {stats['p50']}s "
+              f"p90 {stats['p90']}s p99 {stats['p99']}s max {stats['max']}s.")
 
     def cog_unload(self):
-        self.main_loop.cancel()
+        self.main_task.cancel()
+        self.registrations.close()
 
 
 def setup(bot):
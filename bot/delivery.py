@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Callable, Iterator, Optional
+
+import discord
+
+from .metrics import metrics
+from .outbox import Pacer, Priority, outbox
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """The value `fraction` of the way through the sorted values, 0 if there are none."""
+
+    if not values:
+        return 0.0
+
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class DirectMessageFanOut:
+    """Sends the same embed to many users by DM with a bounded number of workers.
+    Sends are spaced out to stay under Discord's rate limits, and a user that can't be messaged,
+    because they closed their DMs or the bot can't see them anymore, only fails their own delivery.
+    Latency is measured from when the run started, so it shows how late the last reminders arrived."""
+
+    def __init__(self, get_user: Callable[[int], Optional[discord.abc.Messageable]],
+                 concurrency: int = 8, rate: float = 5.0):
+        self.get_user = get_user
+        self.concurrency = concurrency
+        self.pacer = Pacer(rate)
+
+        self.started = 0.0
+        self.latencies: list[float] = []
+
+        self.total = 0
+        self.missing = 0
+        self.closed = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            'sent': len(latencies),
+            'total': self.total,
+            'missing': self.missing,
+            'closed': self.closed,
+            'failed': self.failed,
+            'p50': f'{percentile(latencies, 0.50):.2f}',
+            'p90': f'{percentile(latencies, 0.90):.2f}',
+            'p99': f'{percentile(latencies, 0.99):.2f}',
+            'max': f'{latencies[-1] if latencies else 0:.2f}',
+        }
+
+    async def deliver(self, user_id: int, embed: discord.Embed) -> None:
+        user = self.get_user(user_id)
+        if user is None:
+            self.missing += 1
+            metrics.increment('reminder_dms_total', result='missing')
+            return
+
+        try:
+            await outbox.send(user, Priority.BULK, self.pacer, embed=embed)
+        except discord.Forbidden:
+            self.closed += 1
+            metrics.increment('reminder_dms_total', result='closed')
+            return
+
+        self.latencies.append(time.monotonic() - self.started)
+        metrics.observe('reminder_dm_latency_seconds', self.latencies[-1])
+        metrics.increment('reminder_dms_total', result='sent')
+
+    async def worker(self, user_ids: Iterator[int], embed: discord.Embed) -> None:
+        for user_id in user_ids:
+            try:
+                await self.deliver(user_id, embed)
+            except Exception as exc:
+                print(f'Failed to message {user_id}: {exc}')
+                self.failed += 1
+                metrics.increment('reminder_dms_total', result='failed')
+
+    async def run(self, user_ids: set[int], embed: discord.Embed) -> dict:
+        """Sends `embed` to every user, returns the run's stats once they have all been tried."""
+
+        self.started = time.monotonic()
+        self.total = len(user_ids)
+
+        # The workers share one iterator, so each user is only taken by one of them
+        remaining = iter(user_ids)
+        with metrics.timer('reminder_fan_out_seconds'):
+            await asyncio.gather(*(self.worker(remaining, embed) for _ in range(self.concurrency)))
+
+        return self.stats()
@@ -1,26 +1,15 @@
-from typing import Union
+import os
+import re
+import time
+from dataclasses import dataclass
 
 import discord
 from yaml import safe_load
 
+from .metrics import metrics
+from .outbox import outbox
 
-def dotted_access_dict(input_dict: dict, keys: Union[str, list]):
-    if isinstance(keys, str):
-        keys = keys.split('.')
-
-    if len(keys) == 1:
-        return input_dict.get(keys[0], input_dict)
-    else:
-        return dotted_access_dict(input_dict[keys[0]], keys[1:])
-
-
-def get_highest_color(input_dict: dict, key: str):
-    color = dotted_access_dict(input_dict, key).get('color')
-
-    if color:
-        return color
-
-    return get_highest_color(input_dict, '.'.join(key.split('.')[:-1]))
+PLACEHOLDER = re.compile(r'%\{([^}]*)\}')
 
 
 def color_to_discord(name: str) -> discord.Color:
@@ -32,25 +21,124 @@ def color_to_discord(name: str) -> discord.Color:
     return color
 
 
-async def send_embed(messageable: discord.abc.Messageable, key: str, **kwargs) -> discord.Message:
-    with open('bot/lang.yaml', 'r') as file:
-        all_data = safe_load(file)
+def format_value(placeholder: str, value) -> str:
+    if placeholder == 'groups':
+        return '`, `'.join(value)
+
+    return str(value)
+
+
+class Template:
+    """A string with %{value} placeholders, split once into literal and placeholder segments.
+    Even indexes of `segments` are literals, odd indexes are placeholder names."""
+
+    __slots__ = ('segments',)
+
+    def __init__(self, text: str):
+        self.segments = PLACEHOLDER.split(text)
+
+    def render(self, values: dict[str, str]) -> str:
+        if len(self.segments) == 1:
+            return self.segments[0]
+
+        output = []
+        for index, segment in enumerate(self.segments):
+            if index % 2 == 0:
+                output.append(segment)
+            elif segment in values:
+                output.append(values[segment])
+            else:
+                # Placeholders without a given value are left as is
+                output.append(f'%{{{segment}}}')
+
+        return ''.join(output)
+
 
-    data = dotted_access_dict(all_data, key)
+@dataclass(frozen=True)
+class CatalogEntry:
+    title: Template
+    description: Template
+    color: discord.Color
 
-    # Convert the color stored in the yaml file to a discord.Color
-    color = color_to_discord(get_highest_color(all_data, key))
+    def make_embed(self, **kwargs) -> discord.Embed:
+        values = {placeholder: format_value(placeholder, value) for placeholder, value in kwargs.items()}
+        return discord.Embed(title=self.title.render(values), description=self.description.render(values),
+                             color=self.color)
 
-    description = data.get('description', key + '.description')
-    title = data.get('title', '')
 
-    # Dynamic values are stored as %{value}, replace those with the given values
-    for placeholder, value in kwargs.items():
-        if placeholder == 'groups':
-            value = '`, `'.join(value)
+class MessageCatalog:
+    """Every message in the lang file flattened by its dotted key, with colors and templates resolved.
+    The file is only parsed again when its modification time changes, which is checked at most every `interval`
+    seconds so sending a message doesn't stat the file each time."""
 
-        description = description.replace(f'%{{{placeholder}}}', str(value))
-        title = title.replace(f'%{{{placeholder}}}', str(value))
+    def __init__(self, path: str, interval: float = 2.0):
+        self.path = path
+        self.interval = interval
+        self.checked = 0.0
+        self.mtime = None
+        self.entries: dict[str, CatalogEntry] = {}
+        self.described: set[str] = set()
 
-    embed = discord.Embed(title=title, description=description, color=color)
-    return await messageable.send(embed=embed)
+    def load(self) -> None:
+        mtime = os.stat(self.path).st_mtime_ns
+
+        with open(self.path, 'r') as file:
+            all_data = safe_load(file)
+
+        self.entries = {}
+        self.described = set()
+        self.flatten(all_data, [], color_to_discord(all_data.get('color', '')))
+        self.mtime = mtime
+
+    def flatten(self, data: dict, keys: list[str], color: discord.Color) -> None:
+        if data.get('color'):
+            color = color_to_discord(data['color'])
+
+        key = '.'.join(keys)
+        if 'description' in data:
+            self.described.add(key)
+
+        self.entries[key] = CatalogEntry(
+            title=Template(data.get('title', '')),
+            description=Template(data.get('description', key + '.description')),
+            color=color,
+        )
+
+        for name, value in data.items():
+            if isinstance(value, dict):
+                self.flatten(value, keys + [name], color)
+
+    def reload_if_changed(self) -> None:
+        now = time.monotonic()
+        if self.mtime is not None and now - self.checked < self.interval:
+            return
+
+        self.checked = now
+        if os.stat(self.path).st_mtime_ns != self.mtime:
+            self.load()
+
+    def __getitem__(self, key: str) -> CatalogEntry:
+        self.reload_if_changed()
+
+        try:
+            return self.entries[key]
+        except KeyError:
+            # A missing last key falls back to its parent, like the lookup before the catalog did
+            parent = key.rsplit('.', 1)[0] if '.' in key else ''
+            if parent not in self.entries:
+                raise
+            entry = self.entries[parent]
+            if parent not in self.described:
+                entry = CatalogEntry(entry.title, Template(key + '.description'), entry.color)
+
+            self.entries[key] = entry
+            return entry
+
+
+catalog = MessageCatalog('bot/lang.yaml')
+
+
+async def send_embed(messageable: discord.abc.Messageable, key: str, **kwargs) -> discord.Message:
+    with metrics.timer('send_embed_seconds', key=key):
+        embed = catalog[key].make_embed(**kwargs)
+        return await outbox.send(messageable, embed=embed)
@@ -0,0 +1,224 @@
+import os
+import random
+import sys
+from collections import deque
+from typing import Callable, Iterator, Optional
+
+from watchgod import Change, awatch
+
+
+class MusicLibrary:
+    """In-memory index of the music folder, mapping each (lowercase) group to its list of tracks.
+    Built once with `scan`, then kept up to date by `watch` instead of globbing the disk."""
+
+    def __init__(self, root: str = 'music'):
+        self.root = root
+        self.groups: dict[str, list[str]] = {}
+        self.positions: dict[str, int] = {}  # path -> index in its group's list, for O(1) removal
+        self.on_change: Optional[Callable[[str], None]] = None  # called with a group after its tracks change
+
+    def __contains__(self, group: str) -> bool:
+        return group in self.groups
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def has_track(self, path: str) -> bool:
+        return path in self.positions
+
+    def group_names(self) -> set[str]:
+        return set(self.groups)
+
+    def tracks(self, group: str) -> list[str]:
+        return self.groups.get(group, [])
+
+    def scan(self) -> None:
+        self.groups = {}
+        self.positions = {}
+
+        if not os.path.isdir(self.root):
+            return
+
+        for group_dir in os.scandir(self.root):
+            if not group_dir.is_dir():
+                continue
+
+            for entry in os.scandir(group_dir.path):
+                if entry.is_file():
+                    self.add_track(os.path.join(self.root, group_dir.name, entry.name))
+
+    def group_of(self, path: str) -> str:
+        """Returns the group a path belongs to, or an empty string if it isn't directly inside a group folder."""
+
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        return sys.intern(parts[0].lower()) if len(parts) == 2 else ''
+
+    def add_track(self, path: str) -> None:
+        group = self.group_of(path)
+        if not group or path in self.positions:
+            return
+
+        tracks = self.groups.setdefault(group, [])
+        self.positions[path] = len(tracks)
+        tracks.append(path)
+
+        if self.on_change:
+            self.on_change(group)
+
+    def remove_track(self, path: str) -> None:
+        index = self.positions.pop(path, None)
+        if index is None:
+            return
+
+        group = self.group_of(path)
+        tracks = self.groups[group]
+
+        # Swap the last track into the removed slot so nothing has to shift
+        last = tracks.pop()
+        if last != path:
+            tracks[index] = last
+            self.positions[last] = index
+
+        if not tracks:
+            del self.groups[group]
+
+        if self.on_change:
+            self.on_change(group)
+
+    async def watch(self) -> None:
+        """Applies file system changes to the index as they happen. Runs until cancelled."""
+
+        async for changes in awatch(self.root):
+            for change, path in changes:
+                if change == Change.deleted:
+                    self.remove_track(path)
+                elif change == Change.added:
+                    self.add_track(path)
+
+
+class TrackSelector:
+    """A guild's queue of groups, kept ready for picking random tracks in O(log n).
+    Each queued group gets a weight, either its number of tracks (so every track is equally likely) or 1 (so every
+    group is), stored in a Fenwick tree. The last `history` picks are avoided where possible.
+    Every guild has one of these, so it's slotted and group names are interned so all queues share the library's
+    strings."""
+
+    __slots__ = ('per_group', 'slots', 'groups', 'weights', 'free', 'tree', 'total', 'recent', 'recent_set')
+
+    def __init__(self, weighting: str = 'tracks', history: int = 1):
+        self.per_group = weighting == 'groups'
+
+        self.slots: dict[str, int] = {}
+        self.groups: list[Optional[str]] = []
+        self.weights: list[int] = []
+        self.free: list[int] = []
+        self.tree = [0] * 9  # Fenwick tree over the slots, index 0 is unused
+        self.total = 0
+
+        self.recent: deque[str] = deque(maxlen=history)
+        self.recent_set: set[str] = set()
+
+    def __contains__(self, group: str) -> bool:
+        return group in self.slots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def weight(self, size: int) -> int:
+        return min(size, 1) if self.per_group else size
+
+    def update(self, slot: int, delta: int) -> None:
+        self.weights[slot] += delta
+        self.total += delta
+
+        index = slot + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def grow(self) -> None:
+        self.tree = [0] * (2 * (len(self.tree) - 1) + 1)
+        weights, self.weights, self.total = self.weights, [0] * len(self.weights), 0
+
+        for slot, weight in enumerate(weights):
+            self.update(slot, weight)
+
+    def add(self, group: str, size: int) -> None:
+        if group in self.slots:
+            return
+
+        group = sys.intern(group)
+        if self.free:
+            slot = self.free.pop()
+            self.groups[slot] = group
+        else:
+            if len(self.groups) == len(self.tree) - 1:
+                self.grow()
+            slot = len(self.groups)
+            self.groups.append(group)
+            self.weights.append(0)
+
+        self.slots[group] = slot
+        self.update(slot, self.weight(size))
+
+    def remove(self, group: str) -> None:
+        slot = self.slots.pop(group)
+        self.update(slot, -self.weights[slot])
+        self.groups[slot] = None
+        self.free.append(slot)
+
+    def resize(self, group: str, size: int) -> None:
+        """Updates a queued group's weight after tracks were added to or removed from it."""
+
+        slot = self.slots.get(group)
+        if slot is not None:
+            self.update(slot, self.weight(size) - self.weights[slot])
+
+    def clear(self) -> None:
+        for group in list(self.slots):
+            self.remove(group)
+
+    def find(self, target: int) -> str:
+        """The group whose range of weights contains `target`."""
+
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length() - 1
+
+        while step:
+            if position + step < len(self.tree) and self.tree[position + step] <= target:
+                position += step
+                target -= self.tree[position]
+            step >>= 1
+
+        return self.groups[position]
+
+    def remember(self, track: str) -> None:
+        if not self.recent.maxlen:
+            return
+
+        if track in self.recent_set:
+            # Only happens when every attempt picked a recent track
+            self.recent.remove(track)
+        elif len(self.recent) == self.recent.maxlen:
+            self.recent_set.discard(self.recent[0])
+
+        self.recent.append(track)
+        self.recent_set.add(track)
+
+    def choose(self, library: MusicLibrary, attempts: int = 10) -> Optional[str]:
+        """Picks a random track from the queued groups, or None if they are all empty.
+        Recently played tracks are skipped, unless nothing else came up in `attempts` tries.
+        The pick isn't remembered here, that's up to the caller once the track actually starts playing."""
+
+        if self.total <= 0:
+            return None
+
+        for _ in range(attempts):
+            track = random.choice(library.tracks(self.find(random.randrange(self.total))))
+            if track not in self.recent_set:
+                break
+
+        return track
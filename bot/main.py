@@ -1,16 +1,22 @@
+import asyncio
+import time
 import traceback
 import typing
-from collections import defaultdict
-from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
 from glob import glob
 
 import discord
-from cogwatch import watch
+from aiohttp import web
+from cogwatch import Watcher
 from discord.ext import commands
 from yaml import safe_load
 
-from .lang import send_embed
+from .lang import catalog, send_embed
+from .library import TrackSelector
+from .metadata import TrackInfo
+from .metrics import HTTPLogCounter, instrument_loops, metrics, sample_loop_lag, serve
+from .outbox import batch, outbox
+from .watchdog import LoopWatchdog
 
 
 def read_config():
@@ -19,32 +25,117 @@ def read_config():
     return config
 
 
-@dataclass
 class ClientData:
-    queue: set[str] = field(default_factory=set)
-    now_playing: str = str()
-    timestamp: timedelta = field(default_factory=timedelta)
-    channel: typing.Optional[discord.TextChannel] = None
-    message: typing.Optional[discord.Message] = None
+    """A guild's music state. There's one for every guild the bot has joined, so it's slotted and only keeps ids
+    for the text channel and now playing message, which are looked up through the bot when they're needed."""
+
+    __slots__ = ('queue', 'track', 'upcoming', 'started', 'paused_at', 'channel_id', 'message_id', 'embed')
+
+    def __init__(self, queue: typing.Optional[TrackSelector] = None):
+        self.queue = queue if queue is not None else TrackSelector()
+        self.track: typing.Optional[TrackInfo] = None
+        self.upcoming: typing.Optional[str] = None  # the path picked by the last prefetch, until it starts playing
+        self.started = 0.0  # time.monotonic() of when the current song started, shifted forward by pauses
+        self.paused_at: typing.Optional[float] = None
+        self.channel_id: typing.Optional[int] = None
+        self.message_id: typing.Optional[int] = None
+        self.embed: typing.Optional[discord.Embed] = None  # the now playing message's embed, for bar updates
+
+    @property
+    def now_playing(self) -> typing.Optional[str]:
+        return self.track.path if self.track else None
+
+    @property
+    def position(self) -> float:
+        if not self.started:
+            return 0.0
+
+        return (self.paused_at or time.monotonic()) - self.started
+
+    @property
+    def timestamp(self) -> timedelta:
+        return timedelta(seconds=int(self.position))
+
+    def start_timer(self, started: typing.Optional[float] = None) -> None:
+        self.started = started or time.monotonic()
+        self.paused_at = None
+
+    def pause_timer(self) -> None:
+        self.paused_at = time.monotonic()
+
+    def resume_timer(self) -> None:
+        if self.paused_at:
+            self.started += time.monotonic() - self.paused_at
+            self.paused_at = None
 
 
 class FunBot(commands.Bot):
     def __init__(self):
         super().__init__(command_prefix="&", intents=discord.Intents.all(), case_insensitive=True)
         self.add_check(self.global_check)
+        self.before_invoke(self.start_command_timer)
+        self.after_invoke(self.stop_command_timer)
 
         self.config = read_config()
         self.token = self.config['Bot']['token']
         self.color = discord.Color.gold()
         self.startup_time = datetime.now(timezone.utc)
+        catalog.load()
 
-        self.music_data: defaultdict[int, ClientData] = defaultdict(ClientData)
+        self.music_data: dict[int, ClientData] = {}
+        self.cog_startups: dict[str, asyncio.Task] = {}
+        self.watchdog: typing.Optional[LoopWatchdog] = None
+        self.metrics_runner: typing.Optional[web.AppRunner] = None
+
+        outbox_config = self.config.get('Outbox', {})
+        outbox.configure(outbox_config.get('concurrency', 8), outbox_config.get('rate', 40.0))
+        HTTPLogCounter.install()
+
+    def client_data(self, guild_id: int) -> ClientData:
+        """The guild's music data, created if it doesn't have any yet.
+        Only for places that change it, anything that only reads should use `music_data.get` instead."""
+
+        client_data = self.music_data.get(guild_id)
+
+        if client_data is None:
+            music_config = self.config.get('Music', {})
+            queue = TrackSelector(music_config.get('weighting', 'tracks'), music_config.get('history', 1))
+            client_data = self.music_data[guild_id] = ClientData(queue)
+
+        return client_data
+
+    async def start(self, *args, **kwargs):
+        """Loads the cogs before logging in, so every command works as soon as the bot is ready.
+        The cogs' slow start up work runs in the background while the bot connects."""
 
-    @watch(path='bot/cogs')
-    async def on_ready(self):
         self.load_cogs()
+        await Watcher(self, path='bot/cogs').start()
+
+        self.loop.create_task(sample_loop_lag())
+        metrics_config = self.config.get('Metrics', {})
+        if metrics_config.get('port'):
+            self.metrics_runner = await serve(metrics_config.get('host', '127.0.0.1'), metrics_config['port'])
 
-        print("Bot ready and cogs loaded.")
+        watchdog_config = self.config.get('Watchdog', {})
+        if watchdog_config.get('enabled', False):
+            self.watchdog = LoopWatchdog(watchdog_config.get('threshold', 0.25), watchdog_config.get('interval', 0.05))
+            self.watchdog.start()
+
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        if self.watchdog:
+            self.watchdog.stop()
+
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+
+        await super().close()
+
+    async def on_ready(self):
+        # Also fires after every reconnect, so nothing here should be done only once
+        print(f"Bot ready with {len(self.cogs)} cogs.")
 
     def load_cogs(self):
         cog_list = glob('bot/cogs/*.py')
@@ -57,8 +148,42 @@ class FunBot(commands.Bot):
 
         for cog in cog_list:
             cog = cog.replace('/', '.')[:-3]
+            started = time.perf_counter()
             self.load_extension(cog)
-            print("Loaded", cog)
+            print(f"Loaded {cog} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def add_cog(self, cog: commands.Cog):
+        super().add_cog(cog)
+        instrument_loops(cog)
+
+        # Cogs can put slow set up in a `startup` coroutine, which all run at the same time in the background
+        if hasattr(cog, 'startup'):
+            self.cog_startups[cog.qualified_name] = self.loop.create_task(self.start_cog(cog))
+
+    def remove_cog(self, name: str):
+        startup = self.cog_startups.pop(name, None)
+        if startup:
+            startup.cancel()
+
+        super().remove_cog(name)
+
+    async def start_cog(self, cog: commands.Cog):
+        started = time.perf_counter()
+
+        try:
+            await cog.startup()
+        except Exception as exc:
+            print(f"Failed to start {cog.qualified_name}: {exc}")
+            traceback.print_exc()
+        else:
+            print(f"Started {cog.qualified_name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def start_command_timer(self, ctx: commands.Context):
+        ctx.started = time.perf_counter()
+
+    async def stop_command_timer(self, ctx: commands.Context):
+        metrics.observe('command_seconds', time.perf_counter() - ctx.started, command=ctx.command.qualified_name,
+                        failed=str(ctx.command_failed).lower())
 
     async def global_check(self, ctx: commands.Context):
         await self.wait_until_ready()
@@ -67,13 +192,18 @@ class FunBot(commands.Bot):
     async def unhandled_error(self, ctx: commands.Context, exc: Exception):
         # there's an exception that I didn't have a handle for. This is bad.
         print(exc)
-        await ctx.send("Something bad happened! <@!300050030923087872> pls fix.")
-        await ctx.send(f"`{exc}`")
+        parts = ["Something bad happened! <@!300050030923087872> pls fix.", f"`{exc}`"]
         if hasattr(exc, "original"):
-            await ctx.send(f"```{''.join(traceback.format_tb(exc.original.__traceback__))}```")
-        await ctx.send(f"```{''.join(traceback.format_tb(exc.__traceback__))}```")
+            parts.append(f"```{''.join(traceback.format_tb(exc.original.__traceback__))}```")
+        parts.append(f"```{''.join(traceback.format_tb(exc.__traceback__))}```")
+
+        # One message for the whole report, unless it's too long for one
+        for message in batch(parts):
+            await outbox.send(ctx, content=message)
 
     async def on_command_error(self, ctx: commands.Context, exc: Exception):
+        metrics.increment('command_errors_total', error=type(exc).__name__)
+
         if isinstance(exc, commands.MissingRequiredArgument):
             argument = str(exc.param).split(':')[0]
             await send_embed(ctx, 'error.missing_required_argument', argument=argument)
@@ -0,0 +1,172 @@
+import asyncio
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable, Hashable, Optional
+
+from mutagen import File
+from mutagen.flac import FLAC, Picture
+
+from .metrics import metrics
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+}
+
+
+@dataclass(frozen=True)
+class TrackInfo:
+    path: str
+    title: str
+    artist: str
+    album: str
+    track_number: str
+    duration: timedelta
+    has_art: bool
+
+    @classmethod
+    def empty(cls, path: str) -> 'TrackInfo':
+        """Stands in for a track that couldn't be read, like one deleted while it was playing."""
+
+        return cls(path=path, title=path, artist='', album='', track_number='', duration=timedelta(), has_art=False)
+
+
+def first_tag(file_, key: str, default: str = '') -> str:
+    value = file_.get(key, default)
+
+    if isinstance(value, list):
+        value = value[0] if value else default
+
+    return str(value)
+
+
+def get_art(file_) -> tuple[Optional[Picture], str]:
+    picture = None
+    ext = "jpg"
+
+    if isinstance(file_, FLAC):
+        if file_.pictures:
+            picture = file_.pictures[0]
+            ext = EXTENSIONS.get(picture.mime, "jpg")
+        return picture, ext
+
+    for b64_data in file_.get("metadata_block_picture", []):
+        picture = Picture(base64.b64decode(b64_data))
+        ext = EXTENSIONS.get(picture.mime, "jpg")
+
+    return picture, ext
+
+
+@metrics.timed('mutagen_seconds', call='art')
+def read_art(path: str) -> tuple[Optional[bytes], str]:
+    picture, ext = get_art(File(path))
+    return (picture.data if picture else None), ext
+
+
+def has_art(file_) -> bool:
+    if isinstance(file_, FLAC):
+        return bool(file_.pictures)
+
+    return bool(file_.get("metadata_block_picture"))
+
+
+@metrics.timed('mutagen_seconds', call='tags')
+def read_track_info(path: str) -> TrackInfo:
+    try:
+        file_ = File(path)
+    except FileNotFoundError:
+        return TrackInfo.empty(path)
+
+    if file_ is None:  # not a format mutagen knows
+        return TrackInfo.empty(path)
+
+    return TrackInfo(
+        path=path,
+        title=first_tag(file_, 'title', path),
+        artist=first_tag(file_, 'artist'),
+        album=first_tag(file_, 'album'),
+        track_number=first_tag(file_, 'tracknumber'),
+        duration=timedelta(seconds=file_.info.length // 1),
+        has_art=has_art(file_),
+    )
+
+
+class MetadataCache:
+    """Bounded LRU cache of TrackInfo, keyed by path plus mtime and size so edited files are read again.
+    It's used from the metadata worker threads, so every access holds the lock."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[tuple[str, int, int], TrackInfo] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(path: str) -> tuple[str, int, int]:
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, key: tuple[str, int, int]) -> Optional[TrackInfo]:
+        with self.lock:
+            info = self.entries.get(key)
+            if info is not None:
+                self.entries.move_to_end(key)
+            return info
+
+    def store(self, key: tuple[str, int, int], info: TrackInfo) -> None:
+        with self.lock:
+            self.entries[key] = info
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class MetadataService:
+    """Runs mutagen parsing on a pool of worker threads so it never blocks the event loop.
+    Concurrent requests for the same file share a single parse."""
+
+    def __init__(self, workers: int = 4, cache_size: int = 1024):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metadata')
+        self.cache = MetadataCache(cache_size)
+        self.pending: dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, func: Callable, *args) -> Any:
+        future = self.pending.get(key)
+
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            self.pending[key] = future
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+
+        # Shielded so one caller being cancelled doesn't cancel the parse for everyone else
+        return await asyncio.shield(future)
+
+    def load_tags(self, path: str) -> TrackInfo:
+        """Runs on a worker thread, since even the stat for a cache hit can block on a slow or network drive."""
+
+        try:
+            key = self.cache.key(path)
+        except FileNotFoundError:
+            return TrackInfo.empty(path)
+
+        info = self.cache.lookup(key)
+        if info is None:
+            info = read_track_info(path)
+            self.cache.store(key, info)
+
+        return info
+
+    async def get_tags(self, path: str) -> TrackInfo:
+        return await self.run(('tags', path), self.load_tags, path)
+
+    async def get_art(self, path: str) -> tuple[Optional[bytes], str]:
+        return await self.run(('art', path), read_art, path)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,214 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from discord.ext import tasks
+
+# Upper bounds of the histogram buckets in seconds, the last one catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """The upper bound of the bucket the quantile falls in, which is as precise as a histogram gets."""
+
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+
+        return 0.0
+
+
+class Metrics:
+    """Histograms of how long things take and counters of how often they happen, each with a name and labels.
+    Safe to record from worker threads. Rendered in Prometheus' text format for scraping."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.started = time.monotonic()
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counters = self.counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels: str):
+        """Decorator that records how long each call takes, for both normal and coroutine functions."""
+
+        def decorator(func):
+            if not asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return func(*args, **kwargs)
+
+                return wrapper
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        return decorator
+
+    def summary(self, limit: int = 15) -> list[str]:
+        """The slowest timings at the 99th percentile, one line each, for showing in Discord."""
+
+        with self.lock:
+            rows = [(histogram.quantile(0.99), name, labels, histogram)
+                    for name, histograms in self.histograms.items() for labels, histogram in histograms.items()]
+
+        rows.sort(key=lambda row: row[0], reverse=True)
+        return [f"{name}{format_labels(labels)}: {histogram.count}x, p50 {histogram.quantile(0.5) * 1000:g} ms, "
+                f"p99 {p99 * 1000:g} ms"
+                for p99, name, labels, histogram in rows[:limit]]
+
+    def render(self) -> str:
+        lines = ['# TYPE uptime_seconds gauge', f'uptime_seconds {time.monotonic() - self.started:.3f}']
+
+        with self.lock:
+            for name, counters in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(f'{name}{format_labels(labels)} {value:g}' for labels, value in counters.items())
+
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+
+                for labels, histogram in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class HTTPLogCounter(logging.Filter):
+    """Counts REST requests by status, and the 429s discord.py handles internally, from what it logs about them.
+    A filter rather than a handler, so the warnings are still printed the same as before. Responses are only logged
+    at debug level, so the logger is turned down to it and those records are dropped again unless they were
+    already being logged."""
+
+    RESPONSE = '%s %s with %s has returned %s'
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__()
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+
+    @classmethod
+    def install(cls, name: str = 'discord.http') -> None:
+        logger = logging.getLogger(name)
+        logger.addFilter(cls(logger))
+        logger.setLevel(logging.DEBUG)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            message = record.getMessage()
+            if 'Global rate limit' in message:
+                metrics.increment('discord_rate_limits_total', scope='global')
+            elif 'rate limited' in message:
+                metrics.increment('discord_rate_limits_total', scope='route')
+            return True
+
+        if record.msg == self.RESPONSE:
+            method, _, _, status = record.args
+            metrics.increment('discord_rest_requests_total', method=method, status=str(status))
+
+        return self.debug or record.levelno > logging.DEBUG
+
+
+def instrument_loops(cog) -> None:
+    """Times every iteration of the cog's `tasks.loop`s, by wrapping the function each loop calls."""
+
+    for name in dir(type(cog)):
+        if not isinstance(getattr(type(cog), name, None), tasks.Loop):
+            continue
+
+        loop: tasks.Loop = getattr(cog, name)  # the cog's own copy of the loop
+        if not getattr(loop.coro, 'instrumented', False):
+            loop.coro = metrics.timed('loop_iteration_seconds', loop=name)(loop.coro)
+            loop.coro.instrumented = True
+
+
+async def sample_loop_lag(interval: float = 0.5) -> None:
+    """Measures how late the event loop wakes up from a sleep, which is how long something else blocked it."""
+
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        metrics.observe('event_loop_lag_seconds', max(0.0, time.monotonic() - expected))
+
+
+async def serve(host: str = '127.0.0.1', port: int = 9100) -> web.AppRunner:
+    """Serves the metrics at http://host:port/metrics for Prometheus to scrape.
+    The returned runner has to be cleaned up to close the server."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+metrics = Metrics()
@@ -0,0 +1,223 @@
+import asyncio
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import discord
+from discord.oggparse import OggStream
+
+from .audio import FRAME_LENGTH
+from .metadata import read_track_info
+
+MAGIC = b'FBOPUS1\n'
+LENGTH = struct.Struct('<H')
+
+
+def write_packet(file, packet: bytes) -> None:
+    file.write(LENGTH.pack(len(packet)))
+    file.write(packet)
+
+
+class CachedOpusSource(discord.AudioSource):
+    """Plays a file of pre-encoded Opus packets, each stored after its 2 byte length.
+    The file is memory mapped and frames are handed out as views into the map, so nothing is copied or encoded."""
+
+    def __init__(self, path: str, position: float = 0.0):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.view = memoryview(self.map)
+        self.offset = len(MAGIC)
+
+        # Every packet is one frame long, so seeking is skipping over that many packets
+        for _ in range(round(position / FRAME_LENGTH)):
+            if not self.read():
+                break
+
+    def read(self) -> memoryview:
+        if self.view is None or self.offset + LENGTH.size > len(self.view):
+            return b''
+
+        length, = LENGTH.unpack_from(self.view, self.offset)
+        start = self.offset + LENGTH.size
+        self.offset = start + length
+
+        return self.view[start:self.offset]
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        # The map can't be closed while the voice client may still hold a frame,
+        # dropping the references lets it close once the last frame is gone
+        self.view = None
+        self.map = None
+
+
+class EncodingSource(discord.AudioSource):
+    """Encodes a track to Opus packets with ffmpeg, like discord.FFmpegOpusAudio, but keeps the process in reach
+    so whether it exited cleanly can be checked once the stream has ended."""
+
+    def __init__(self, path: str, bitrate: int = 128):
+        self.process = subprocess.Popen(['ffmpeg', '-i', path, '-map_metadata', '-1', '-f', 'opus', '-c:a', 'libopus',
+                                         '-ar', '48000', '-ac', '2', '-b:a', f'{bitrate}k', '-loglevel', 'warning',
+                                         'pipe:1'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        self.packets = OggStream(self.process.stdout).iter_packets()
+
+    def read(self) -> bytes:
+        return next(self.packets, b'')
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+
+
+class RecordingSource(discord.AudioSource):
+    """Plays an ffmpeg Opus source while writing its packets to the cache.
+    The cache file only appears once the whole track has been played and ffmpeg exited cleanly, with about as many
+    packets as the track's `duration` needs when it's known. A skipped or failed track leaves nothing behind.
+    Waiting for ffmpeg to exit happens on a thread of its own, so the audio thread never blocks on it, and `done`
+    is set once the recording has been kept or thrown away."""
+
+    def __init__(self, source: EncodingSource, cache_path: str, duration: Optional[float] = None):
+        self.source = source
+        self.cache_path = cache_path
+        self.duration = duration
+        self.temp_path = f'{cache_path}.{id(self)}.tmp'
+        self.packets = 0
+        self.committed = False
+        self.done = threading.Event()
+
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(MAGIC)
+
+    def read(self) -> bytes:
+        packet = self.source.read()
+
+        if self.file:
+            if packet:
+                write_packet(self.file, packet)
+                self.packets += 1
+            else:
+                self.file.close()
+                self.file = None
+                threading.Thread(target=self.finish, name='opus-recording', daemon=True).start()
+
+        return packet
+
+    def finish(self) -> None:
+        try:
+            if self.source.process.wait() == 0 and self.complete():
+                os.replace(self.temp_path, self.cache_path)
+                self.committed = True
+            else:
+                os.remove(self.temp_path)
+        finally:
+            self.source.process.stdout.close()
+            self.done.set()
+
+    def complete(self) -> bool:
+        """Whether the stream had the whole track in it, rather than ending part way."""
+
+        if self.duration is None:
+            return self.packets > 0
+
+        # Durations are rounded down to the second, so a whole track is never shorter but can be up to a second longer
+        played = self.packets * FRAME_LENGTH
+        return self.duration - 0.1 <= played <= self.duration + max(1.0, self.duration * 0.02)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        # Once the stream has ended ffmpeg is left to exit by itself, so finish can tell how it went
+        if self.file:
+            self.source.cleanup()
+            self.file.close()
+            self.file = None
+            os.remove(self.temp_path)
+            self.done.set()
+
+
+class OpusCache:
+    """Directory of tracks that have already been encoded to Opus, so replaying them doesn't need ffmpeg.
+    Files are named after the track's path, mtime and size so edited tracks are encoded again."""
+
+    def __init__(self, directory: str, workers: int = 2):
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='opus')
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Recordings that were still going when the bot stopped
+        for path in glob.glob(os.path.join(glob.escape(directory), '*.tmp')):
+            os.remove(path)
+
+    def cache_path(self, path: str) -> str:
+        stat = os.stat(path)
+        digest = hashlib.sha1(f'{path}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode()).hexdigest()
+        return os.path.join(self.directory, f'{digest}.packets')
+
+    def source(self, path: str, position: float = 0.0, duration: Optional[float] = None) -> discord.AudioSource:
+        """A source for the track that streams from the cache, or records into it if it isn't cached yet.
+        Tracks that don't start from the beginning can't be recorded, those are just played through ffmpeg.
+        The `duration` is used to check a recording got the whole track before it's kept."""
+
+        cache_path = self.cache_path(path)
+
+        if os.path.exists(cache_path):
+            return CachedOpusSource(cache_path, position)
+
+        if position:
+            return discord.FFmpegOpusAudio(path, before_options=f'-ss {position:.2f}')
+
+        return RecordingSource(EncodingSource(path), cache_path, duration)
+
+    def build(self, path: str) -> bool:
+        """Encodes a track into the cache, returns False if it was already there.
+        Raises if ffmpeg couldn't encode all of it."""
+
+        cache_path = self.cache_path(path)
+        if os.path.exists(cache_path):
+            return False
+
+        duration = read_track_info(path).duration.total_seconds()
+        source = RecordingSource(EncodingSource(path), cache_path, duration)
+        try:
+            while source.read():
+                pass
+        finally:
+            source.cleanup()
+
+        source.done.wait()
+
+        if not source.committed:
+            raise RuntimeError('ffmpeg failed or stopped before the end of the track')
+
+        return True
+
+    async def build_all(self, paths: list[str]) -> int:
+        """Encodes every track that isn't cached yet on the worker threads, returns how many were encoded."""
+
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(self.executor, self.build, path) for path in paths),
+                                       return_exceptions=True)
+
+        for path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                print(f'Failed to encode {path}: {result}')
+
+        return sum(result is True for result in results)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Any, Callable, Optional
+
+import discord
+
+from .metrics import metrics
+
+MESSAGE_LIMIT = 2000
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # replies to commands, someone is waiting for them
+    NOW_PLAYING = 1  # now playing messages and their progress bars
+    BULK = 2  # background work like reminder DMs and cover art uploads
+
+
+class Pacer:
+    """Spaces out requests to at most `rate` a second, handing out slots in the order they're asked for."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+
+    def reserve(self) -> float:
+        """Takes the next free slot, returns its time.monotonic() time."""
+
+        slot = max(time.monotonic(), self.next_slot)
+        self.next_slot = slot + self.interval
+        return slot
+
+
+class Job:
+    __slots__ = ('func', 'kwargs', 'priority', 'pacer', 'future', 'queued', 'message_id')
+
+    def __init__(self, func: Callable, kwargs: dict, priority: Priority, pacer: Optional[Pacer] = None,
+                 message_id: Optional[int] = None):
+        self.func = func
+        self.kwargs = kwargs
+        self.priority = priority
+        self.pacer = pacer  # the rate limit of the work it's part of, on top of the outbox's own
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued = time.monotonic()
+        self.message_id = message_id  # only set for edits, which are coalesced by message
+
+
+class PrioritySlots:
+    """A semaphore that lets the highest priority waiter in first, in the order they arrived within a priority."""
+
+    def __init__(self, concurrency: int):
+        self.free = concurrency
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.order = itertools.count()
+
+    async def acquire(self, priority: Priority) -> None:
+        if self.free and not self.waiters:
+            self.free -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Given a slot just as it was cancelled, so pass it on to the next waiter
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.free += 1
+
+
+class Outbox:
+    """Every message the bot sends, edits or deletes, queued by channel and sent in priority order.
+    Each channel sends one request at a time, the way Discord rate limits them, and at most `concurrency`
+    requests are in flight at once. Background work is also started no faster than `rate` a second, and work with
+    a rate limit of its own passes its Pacer along and waits once for whichever of the two slots is later. That
+    waiting happens before a request takes one of the `concurrency` slots, so a burst of background work can't
+    hold up replies to commands, which aren't paced beyond discord.py's own rate limiting. An edit to a message that already has one queued replaces it instead of
+    being queued too, so only the latest state is sent. A channel that gets rate limited anyway is held back for a
+    while."""
+
+    def __init__(self, concurrency: int = 8, rate: float = 40.0, max_backoff: float = 60.0):
+        self.slots = PrioritySlots(concurrency)
+        self.pacer = Pacer(rate)
+        self.max_backoff = max_backoff
+
+        self.order = itertools.count()
+        self.queues: dict[int, list[tuple[int, int, Job]]] = {}  # channel or user id -> queued jobs
+        self.workers: dict[int, asyncio.Task] = {}
+        self.edits: dict[int, Job] = {}  # message id -> the queued edit to it
+        self.backoff: dict[int, float] = {}
+        self.backoff_until: dict[int, float] = {}
+
+        self.coalesced = 0
+
+    def configure(self, concurrency: int = 8, rate: float = 40.0) -> None:
+        self.slots = PrioritySlots(concurrency)
+        self.pacer = Pacer(rate)
+
+    async def send(self, messageable: discord.abc.Messageable, priority: Priority = Priority.INTERACTIVE,
+                   pacer: Optional[Pacer] = None, **kwargs) -> discord.Message:
+        """Queues `messageable.send(**kwargs)`, returns the message once it has been sent."""
+
+        # A context sends to its channel, so it shares that channel's queue
+        key = getattr(messageable, 'channel', messageable).id
+        return await self.submit(key, Job(messageable.send, kwargs, priority, pacer))
+
+    async def edit(self, channel: discord.TextChannel, message_id: int, priority: Priority = Priority.INTERACTIVE,
+                   **kwargs) -> None:
+        job = self.edits.get(message_id)
+        if job is not None:
+            job.kwargs = kwargs
+            self.coalesced += 1
+            return await asyncio.shield(job.future)
+
+        job = self.edits[message_id] = Job(channel.get_partial_message(message_id).edit, kwargs, priority,
+                                           message_id=message_id)
+        return await self.submit(channel.id, job)
+
+    async def delete(self, channel: discord.TextChannel, message_id: int,
+                     priority: Priority = Priority.INTERACTIVE) -> None:
+        return await self.submit(channel.id, Job(channel.get_partial_message(message_id).delete, {}, priority))
+
+    async def submit(self, key: int, job: Job) -> Any:
+        heapq.heappush(self.queues.setdefault(key, []), (job.priority, next(self.order), job))
+
+        if key not in self.workers:
+            self.workers[key] = asyncio.ensure_future(self.drain(key))
+
+        # Shielded so a caller that stops waiting doesn't take the send down with it
+        return await asyncio.shield(job.future)
+
+    async def drain(self, key: int) -> None:
+        queue = self.queues[key]
+
+        try:
+            while queue:
+                await asyncio.sleep(self.backoff_until.get(key, 0) - time.monotonic())
+
+                priority, _, job = heapq.heappop(queue)
+
+                slot = self.pacer.reserve() if priority == Priority.BULK else time.monotonic()
+                if job.pacer:
+                    slot = max(slot, job.pacer.reserve())
+                await asyncio.sleep(slot - time.monotonic())
+
+                await self.slots.acquire(priority)
+                try:
+                    if job.message_id is not None:
+                        self.edits.pop(job.message_id, None)  # edits from here on are queued after this one
+
+                    metrics.observe('outbox_wait_seconds', time.monotonic() - job.queued, priority=priority.name)
+                    await self.run(key, job)
+                finally:
+                    self.slots.release()
+        finally:
+            del self.workers[key]
+            del self.queues[key]
+
+    async def run(self, key: int, job: Job) -> None:
+        try:
+            result = await job.func(**job.kwargs)
+        except discord.HTTPException as exc:
+            if exc.status == 429:
+                backoff = self.backoff.get(key, 1.0)
+                self.backoff_until[key] = time.monotonic() + backoff
+                self.backoff[key] = min(backoff * 2, self.max_backoff)
+
+            job.future.set_exception(exc)
+        except Exception as exc:
+            job.future.set_exception(exc)
+        else:
+            self.backoff.pop(key, None)
+            self.backoff_until.pop(key, None)
+            job.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'channels': len(self.queues),
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'coalesced': self.coalesced,
+        }
+
+
+def batch(parts: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Joins the parts of a report into as few messages as fit Discord's length limit, one part per line.
+    A part that doesn't fit in a message by itself is cut down to the limit."""
+
+    messages = []
+    for part in parts:
+        part = part[:limit]
+
+        if messages and len(messages[-1]) + 1 + len(part) <= limit:
+            messages[-1] += '\n' + part
+        else:
+            messages.append(part)
+
+    return messages
+
+
+outbox = Outbox()
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+
+@dataclass
+class SavedPlayback:
+    guild_id: int
+    voice_channel_id: int
+    text_channel_id: int
+    queue: list[str]
+    now_playing: Optional[str]
+    position: float
+    paused: bool
+    message_id: Optional[int]
+
+
+class PlaybackStore:
+    """Snapshot of every guild's music state, so a restart can reconnect and carry on where it left off.
+    Each change is written as its own small update when it happens. Instead of saving the position over and over,
+    the wall clock time the song started is stored, along with when the bot was last known to be running, which is
+    updated whenever a song changes and when the store is closed. The position is how far the song had got by
+    then, so the time the bot was down isn't counted as played."""
+
+    def __init__(self, path: str = 'playback.db'):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS playback ('
+                        'guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, text_channel_id INTEGER, '
+                        "queue TEXT DEFAULT '[]', now_playing TEXT, started REAL, "
+                        'paused_position REAL, message_id INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS alive (id INTEGER PRIMARY KEY CHECK (id = 0), last_alive REAL)')
+
+        # Read before anything marks this run as alive, so it's when the previous run stopped
+        row = self.db.execute('SELECT last_alive FROM alive').fetchone()
+        self.last_alive: Optional[float] = row[0] if row else None
+
+    def mark_alive(self) -> None:
+        self.db.execute('INSERT OR REPLACE INTO alive VALUES (0, ?)', (time.time(),))
+
+    def save_channels(self, guild_id: int, voice_channel_id: int, text_channel_id: int) -> None:
+        self.db.execute('INSERT INTO playback (guild_id, voice_channel_id, text_channel_id) VALUES (?, ?, ?) '
+                        'ON CONFLICT (guild_id) DO UPDATE SET '
+                        'voice_channel_id = excluded.voice_channel_id, text_channel_id = excluded.text_channel_id',
+                        (guild_id, voice_channel_id, text_channel_id))
+
+    def save_queue(self, guild_id: int, groups: Iterable[str]) -> None:
+        self.db.execute('UPDATE playback SET queue = ? WHERE guild_id = ?', (json.dumps(list(groups)), guild_id))
+
+    def save_track(self, guild_id: int, path: Optional[str], position: float = 0.0) -> None:
+        self.db.execute('UPDATE playback SET now_playing = ?, started = ?, paused_position = NULL WHERE guild_id = ?',
+                        (path, time.time() - position, guild_id))
+        self.mark_alive()
+
+    def save_message(self, guild_id: int, message_id: Optional[int]) -> None:
+        self.db.execute('UPDATE playback SET message_id = ? WHERE guild_id = ?', (message_id, guild_id))
+
+    def save_pause(self, guild_id: int, position: float) -> None:
+        self.db.execute('UPDATE playback SET paused_position = ? WHERE guild_id = ?', (position, guild_id))
+
+    def save_resume(self, guild_id: int, position: float) -> None:
+        self.db.execute('UPDATE playback SET started = ?, paused_position = NULL WHERE guild_id = ?',
+                        (time.time() - position, guild_id))
+
+    def delete(self, guild_id: int) -> None:
+        self.db.execute('DELETE FROM playback WHERE guild_id = ?', (guild_id,))
+
+    def load(self) -> list[SavedPlayback]:
+        now = time.time()
+        stopped = min(self.last_alive or now, now)
+        rows = self.db.execute('SELECT guild_id, voice_channel_id, text_channel_id, queue, now_playing, started, '
+                               'paused_position, message_id FROM playback').fetchall()
+
+        return [
+            SavedPlayback(
+                guild_id=guild_id,
+                voice_channel_id=voice_channel_id,
+                text_channel_id=text_channel_id,
+                queue=json.loads(queue),
+                now_playing=now_playing,
+                position=paused_position if paused_position is not None else max(0.0, stopped - (started or stopped)),
+                paused=paused_position is not None,
+                message_id=message_id,
+            )
+            for guild_id, voice_channel_id, text_channel_id, queue, now_playing, started, paused_position, message_id
+            in rows
+        ]
+
+    def close(self) -> None:
+        self.mark_alive()
+        self.db.close()
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+from datetime import timedelta
+from functools import lru_cache
+from typing import Callable, Optional
+
+import discord
+
+from .main import ClientData
+from .outbox import Priority, outbox
+
+BAR_LENGTH = 30
+
+# Every position the knob can be in, from the very start to the very end
+BARS = tuple('▬' * start + '🔘' + '▬' * (BAR_LENGTH - 1 - start) for start in range(BAR_LENGTH + 1))
+
+
+@lru_cache(maxsize=4096)
+def seconds_to_str(seconds: int) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    if hours:
+        return f'{hours}:{minutes:02}:{seconds:02}'
+
+    return f'{minutes}:{seconds:02}'
+
+
+def whole_seconds(time: timedelta) -> int:
+    return time.days * 86400 + time.seconds
+
+
+def timedelta_to_str(time: timedelta) -> str:
+    return seconds_to_str(whole_seconds(time))
+
+
+def create_bar(current_time: timedelta, total_time: timedelta) -> str:
+    current = whole_seconds(current_time)
+    total = whole_seconds(total_time)
+
+    start = min(round(current * BAR_LENGTH / total), BAR_LENGTH) if total > 0 else 0
+
+    return f'`{seconds_to_str(current)} {BARS[start]} {seconds_to_str(total)}`'
+
+
+class BarScheduler:
+    """Edits the progress bar of every now playing message.
+    Edits are spread over the interval with some jitter instead of sent in one burst, and skipped when the bar would
+    look the same. They go through the outbox, which holds back channels that got rate limited.
+    The interval grows when more guilds are playing than `max_rate` edits a second can keep up with.
+    Messages are edited through `get_channel`, since guilds only keep the ids of their channel and message."""
+
+    def __init__(self, get_channel: Callable[[int], Optional[discord.TextChannel]], interval: float = 5.0,
+                 max_rate: float = 5.0):
+        self.get_channel = get_channel
+        self.interval = interval
+        self.max_rate = max_rate
+
+        self.last_bars: dict[int, str] = {}  # message id -> bar it shows
+
+        self.started = time.monotonic()
+        self.edits = 0
+        self.skipped = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def interval_for(self, active: int) -> float:
+        return max(self.interval, active / self.max_rate)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'edits': self.edits,
+            'skipped': self.skipped,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'rate': f'{self.edits / elapsed if elapsed else 0:.2f}',
+        }
+
+    async def run_pass(self, playing: list[ClientData], interval: float) -> None:
+        """Updates every given guild once, spread out over `interval` seconds."""
+
+        playing = [client_data for client_data in playing if client_data.embed and client_data.track]
+        self.last_bars = {client_data.message_id: self.last_bars.get(client_data.message_id, '')
+                          for client_data in playing}
+
+        if not playing:
+            return
+
+        # One guild's failure mustn't stop the others, or the loop running the passes
+        spacing = interval / len(playing)
+        await asyncio.gather(*(self.update_later(client_data, spacing * (index + random.random()))
+                               for index, client_data in enumerate(playing)), return_exceptions=True)
+
+    async def update_later(self, client_data: ClientData, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.update(client_data)
+
+    async def update(self, client_data: ClientData) -> None:
+        embed = client_data.embed
+        if not embed or not client_data.track:
+            return
+
+        new_bar = create_bar(client_data.timestamp, client_data.track.duration)
+        channel_id, message_id = client_data.channel_id, client_data.message_id
+
+        if self.last_bars.get(message_id) == new_bar:
+            self.skipped += 1
+            return
+
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return
+
+        embed.set_field_at(len(embed.fields) - 1, name="** **", value=new_bar)
+
+        try:
+            await outbox.edit(channel, message_id, Priority.NOW_PLAYING, embed=embed)
+        except discord.NotFound:
+            return
+        except discord.HTTPException as exc:
+            if exc.status == 429:
+                self.rate_limited += 1
+            else:
+                # Like a 403 after losing permissions in the channel, the next pass tries again
+                self.failed += 1
+                print(f"Failed to update the progress bar in channel {channel_id}: {exc}")
+            return
+
+        self.last_bars[message_id] = new_bar
+        self.edits += 1
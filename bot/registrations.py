@@ -0,0 +1,89 @@
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+
+@dataclass(frozen=True)
+class Registration:
+    lunch_period: int
+    every_day: bool  # whether they have their electives every day, or only on their timetable's elective days
+    guild_id: Optional[int] = None  # the guild they registered in, whose timetable they follow
+
+
+class RegistrationStore:
+    """Users registered for reminders, backed by SQLite.
+    Everything is loaded into memory once, so lookups never touch the disk, and every change is written
+    as a single row in its own transaction, so registrations made at the same time can't overwrite each other."""
+
+    def __init__(self, path: str = 'registrations.db'):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS registrations ('
+                        'user_id INTEGER PRIMARY KEY, lunch_period INTEGER, every_day INTEGER, guild_id INTEGER)')
+        self.migrate_guild_column()
+
+        self.users: dict[int, Registration] = {
+            user_id: Registration(lunch_period, bool(every_day), guild_id)
+            for user_id, lunch_period, every_day, guild_id
+            in self.db.execute('SELECT user_id, lunch_period, every_day, guild_id FROM registrations')
+        }
+
+    def migrate_guild_column(self) -> None:
+        """Adds the guild column to stores from before timetables were per guild."""
+
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(registrations)')]
+        if 'guild_id' not in columns:
+            self.db.execute('ALTER TABLE registrations ADD COLUMN guild_id INTEGER')
+
+    def migrate_json(self, json_path: str = 'user_data.json') -> None:
+        """One time import of the old user_data.json, which is renamed afterwards so it isn't imported again."""
+
+        if not os.path.exists(json_path):
+            return
+
+        with open(json_path, 'r') as file:
+            old_data: dict[str, dict] = json.load(file)
+
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR IGNORE INTO registrations VALUES (?, ?, ?, NULL)',
+                                ((int(user_id), user_data['lunch_period'], user_data['every_day'])
+                                 for user_id, user_data in old_data.items()))
+
+        for user_id, user_data in old_data.items():
+            self.users.setdefault(int(user_id), Registration(user_data['lunch_period'], user_data['every_day']))
+
+        os.replace(json_path, json_path + '.migrated')
+        print(f"Migrated {len(old_data)} registrations from {json_path}")
+
+    def get(self, user_id: int) -> Optional[Registration]:
+        return self.users.get(user_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.users)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def items(self):
+        return self.users.items()
+
+    def add(self, user_id: int, registration: Registration) -> None:
+        self.db.execute('INSERT OR REPLACE INTO registrations VALUES (?, ?, ?, ?)',
+                        (user_id, registration.lunch_period, registration.every_day, registration.guild_id))
+        self.users[user_id] = registration
+
+    def remove(self, user_id: int) -> bool:
+        """Unregisters a user, returns False if they weren't registered."""
+
+        self.db.execute('DELETE FROM registrations WHERE user_id = ?', (user_id,))
+        return self.users.pop(user_id, None) is not None
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,169 @@
+import asyncio
+import bisect
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo
+
+from .registrations import Registration
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# The schedule reminders were first written for, used when config.yaml doesn't have any timetables
+DEFAULT_TIMETABLE = {
+    'remind_before': 1,
+    'days': ['mon', 'tue', 'wed', 'thu', 'fri'],
+    'periods': {1: '8:35', 2: '9:30', 3: '10:25', 4: '11:20', 5: '12:15', 6: '13:10', 7: '14:05', 8: '15:00'},
+    'lunch_periods': [5, 6],
+    'elective_days': ['mon'],
+}
+
+
+def parse_time(value: str) -> int:
+    """Minutes since midnight of a 24 hour "H:MM" time."""
+
+    if isinstance(value, int):
+        return value  # YAML reads unquoted times as base 60 numbers, which comes out as minutes since midnight
+
+    hours, minutes = str(value).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_time(minutes: int) -> str:
+    hours, minutes = divmod(minutes, 60)
+    return f'{(hours - 1) % 12 + 1}:{minutes:02}'
+
+
+class Timetable:
+    """A school's bell schedule, compiled from its config into a sorted list of reminder times for each weekday,
+    so the next reminder is found with a bisect. Days can have their own periods in `variants`, and times are
+    in `timezone`, or the machine's local time if there isn't one.
+    A student has lunch in one of `lunch_periods` and electives in the others, which they're only reminded of on
+    `elective_days` unless they have them every day. Raises ValueError if there are no lunch periods, or one of
+    them isn't in `periods` or can't be shown as a 0 to 9 number emoji, since registering asks which one the
+    student has by reacting with its number."""
+
+    def __init__(self, periods: dict, lunch_periods: Iterable[int], timezone: Optional[str] = None,
+                 remind_before: int = 1, days: Iterable[str] = DAYS[:5], variants: Optional[dict] = None,
+                 elective_days: Iterable[str] = ('mon',)):
+        self.zone = ZoneInfo(timezone) if timezone else None
+        self.remind_before = remind_before
+        self.starts = {int(period): parse_time(start) for period, start in periods.items()}
+        self.lunch_periods = [int(period) for period in lunch_periods]
+
+        if not self.lunch_periods:
+            raise ValueError('a timetable needs at least one lunch period')
+        missing = [period for period in self.lunch_periods if period not in self.starts]
+        if missing:
+            raise ValueError(f"lunch periods {missing} aren't in the timetable's periods")
+        if any(not 0 <= period <= 9 for period in self.lunch_periods):
+            raise ValueError('lunch periods have to be between 0 and 9')
+        self.elective_days = {DAYS.index(day) for day in elective_days}
+
+        variants = variants or {}
+        self.days: list[tuple[list[int], list[int]]] = []  # for each weekday, its reminder minutes and periods
+
+        for day in DAYS:
+            reminders = []
+            if day in days:
+                starts = variants.get(day, periods)
+                reminders = sorted((parse_time(start) - remind_before, int(period))
+                                   for period, start in starts.items())
+
+            self.days.append(([minute for minute, _ in reminders], [period for _, period in reminders]))
+
+        self.periods = {period for _, periods in self.days for period in periods}
+
+    def next_reminder(self, after: float) -> Optional[tuple[float, int, int]]:
+        """The first reminder strictly after the timestamp `after`, as its timestamp, period and weekday.
+        None if the timetable doesn't have any periods."""
+
+        now = datetime.fromtimestamp(after, self.zone)
+        day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes, periods = self.days[day.weekday()]
+        index = bisect.bisect_right(minutes, (now - day) / timedelta(minutes=1))
+
+        for _ in range(8):
+            if index < len(minutes):
+                when = day + timedelta(minutes=minutes[index])
+                return when.timestamp(), periods[index], day.weekday()
+
+            day += timedelta(days=1)
+            minutes, periods = self.days[day.weekday()]
+            index = 0
+
+        return None
+
+
+class ReminderIndex:
+    """Which users get reminded for which period of a timetable, updated as users register and unregister,
+    so a period starting doesn't mean going through every registration."""
+
+    def __init__(self, timetable: Timetable):
+        self.timetable = timetable
+        self.daily: dict[int, set[int]] = {period: set() for period in timetable.periods}
+        self.electives: dict[int, set[int]] = {period: set() for period in timetable.lunch_periods}
+
+    def add(self, user_id: int, registration: Registration) -> None:
+        lunch = registration.lunch_period
+
+        for period, users in self.daily.items():
+            if period == lunch:  # we don't want to ping on lunch periods
+                continue
+
+            if period in self.electives and not registration.every_day:
+                self.electives[period].add(user_id)
+            else:
+                users.add(user_id)
+
+    def remove(self, user_id: int) -> None:
+        for users in (*self.daily.values(), *self.electives.values()):
+            users.discard(user_id)
+
+    def recipients(self, period: int, weekday: int) -> set[int]:
+        """A copy of the users to remind, so registrations can change while the reminders are being sent."""
+
+        users = self.daily.get(period, set())
+
+        if weekday in self.timetable.elective_days and period in self.electives:
+            return users | self.electives[period]
+
+        return users.copy()
+
+
+class TimerHeap:
+    """The next reminder of every timetable in one heap, so a single task can sleep until whichever is first."""
+
+    def __init__(self, timetables: dict[str, Timetable]):
+        self.timetables = timetables
+        self.heap: list[tuple[float, int, int, str]] = []  # (timestamp, period, weekday, timetable)
+
+        now = time.time()
+        for name in timetables:
+            self.schedule(name, now)
+
+    def schedule(self, name: str, after: float) -> None:
+        reminder = self.timetables[name].next_reminder(after)
+        if reminder is not None:
+            heapq.heappush(self.heap, (*reminder, name))
+
+    def peek(self) -> Optional[float]:
+        return self.heap[0][0] if self.heap else None
+
+    def pop(self) -> tuple[str, int, int]:
+        """Takes the earliest reminder and schedules its timetable's next one, returns its timetable, period and
+        weekday."""
+
+        when, period, weekday, name = heapq.heappop(self.heap)
+        self.schedule(name, when)
+
+        return name, period, weekday
+
+
+async def sleep_until(when: float) -> None:
+    """Sleeps until a wall clock timestamp. Wakes up at least every hour to look at the clock again,
+    so changes to it don't throw the wake up time off."""
+
+    while (delay := when - time.time()) > 0:
+        await asyncio.sleep(min(delay, 3600))
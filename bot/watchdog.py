@@ -0,0 +1,164 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Optional
+
+from discord.ext import commands
+
+from .metrics import metrics
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Wrappers that are on the stack around the code that's actually blocking
+WRAPPERS = {os.path.join(BOT_DIR, 'metrics.py')}
+
+
+class BlockingSite:
+    """Every stall blamed on one line of the bot's code."""
+
+    __slots__ = ('stalls', 'total', 'longest', 'running', 'stack')
+
+    def __init__(self):
+        self.stalls = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.running: Counter[str] = Counter()  # the commands and tasks that were running when it stalled
+        self.stack: list[str] = []  # the stack of the longest stall
+
+    def add(self, duration: float, running: str, stack: list[str]) -> None:
+        self.stalls += 1
+        self.total += duration
+        self.running[running] += 1
+
+        if duration >= self.longest:
+            self.longest = duration
+            self.stack = stack
+
+
+class LoopWatchdog:
+    """Notices when the event loop hasn't run for longer than `threshold` seconds, because something is blocking it.
+    A task on the loop ticks a heartbeat, and a separate thread samples the loop thread's stack while the heartbeat
+    is late. When the loop gets going again the stall is blamed on the line of the bot's code seen in the most
+    samples, so stalls add up by call site and the worst offenders can be ranked."""
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+
+        self.sites: dict[str, BlockingSite] = {}
+        self.last_tick = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """Starts watching the running loop, returns the heartbeat task."""
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.last_tick = time.monotonic()
+
+        self.thread = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.thread.start()
+        self.task = self.loop.create_task(self.heartbeat())
+        return self.task
+
+    def stop(self) -> None:
+        """Stops the heartbeat and waits for the watching thread to finish."""
+
+        self.stopped.set()
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    async def heartbeat(self) -> None:
+        while not self.stopped.is_set():
+            self.last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def watch(self) -> None:
+        samples: Counter[str] = Counter()
+        stacks: dict[str, tuple[str, list[str]]] = {}
+
+        while not self.stopped.wait(self.interval):
+            stalled = time.monotonic() - self.last_tick - self.interval
+            if stalled >= self.threshold:
+                site, running, stack = self.sample()
+                samples[site] += 1
+                stacks.setdefault(site, (running, stack))
+                longest = stalled
+            elif samples:
+                # The loop is running again, so the stall is over
+                site, _ = samples.most_common(1)[0]
+                self.record(site, longest, *stacks[site])
+                samples.clear()
+                stacks.clear()
+
+    def sample(self) -> tuple[str, str, list[str]]:
+        """The call site the loop is stuck at, what was running there, and the stack leading to it."""
+
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return 'unknown', 'unknown', []
+
+        stack = traceback.extract_stack(frame)
+        return call_site(stack), self.running(frame), traceback.format_list(stack)
+
+    def running(self, frame) -> str:
+        """The command being invoked if there is one on the stack, otherwise the task the loop was running."""
+
+        while frame is not None:
+            ctx = frame.f_locals.get('ctx')
+            if isinstance(ctx, commands.Context) and ctx.command is not None:
+                return f'command {ctx.command.qualified_name}'
+            frame = frame.f_back
+
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            return 'callback'
+
+        return f'task {task.get_coro().__qualname__}'
+
+    def record(self, site: str, duration: float, running: str, stack: list[str]) -> None:
+        with self.lock:
+            first = site not in self.sites
+            self.sites.setdefault(site, BlockingSite()).add(duration, running, stack)
+
+        metrics.observe('event_loop_stall_seconds', duration, site=site)
+        print(f"Event loop blocked for {duration * 1000:.0f} ms at {site} by {running}")
+        if first:
+            print(''.join(stack), end='')
+
+    def report(self, limit: int = 10) -> list[str]:
+        """The call sites that blocked the loop for the longest in total, one line each."""
+
+        with self.lock:
+            sites = sorted(self.sites.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+
+            return [f"{site}: {blocking.stalls}x, {blocking.total:.2f} s total, {blocking.longest * 1000:.0f} ms max, "
+                    f"by {', '.join(running for running, _ in blocking.running.most_common(3))}"
+                    for site, blocking in sites]
+
+
+def call_site(stack: traceback.StackSummary) -> str:
+    """The innermost line of the bot's own code on the stack, which is the one to fix even when the time is spent
+    inside a library it called. The innermost line of all if none of the bot's code is on it."""
+
+    frames = [frame for frame in stack
+              if frame.filename.startswith(BOT_DIR) and frame.filename not in WRAPPERS] or list(stack)
+    if not frames:
+        return 'unknown'
+
+    frame = frames[-1]
+    return f"{os.path.relpath(frame.filename)}:{frame.lineno} in {frame.name}"